@@ -1,4 +1,3 @@
-
 #!/bin/bash
 until python manage.py migrate; do
   sleep 2
@@ -6,4 +5,15 @@ until python manage.py migrate; do
 done
 
 echo "Django is ready.";
-python manage.py runserver 0.0.0.0:8000
+# SERVER=runserver for development, wsgi (the default) or asgi for production
+case "${SERVER:-wsgi}" in
+  runserver)
+    exec python manage.py runserver 0.0.0.0:8000
+    ;;
+  asgi)
+    exec gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker santex_test.asgi:application
+    ;;
+  *)
+    exec gunicorn -c gunicorn.conf.py santex_test.wsgi:application
+    ;;
+esac
@@ -0,0 +1,100 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections, connection
+
+
+def database_sync_to_async(func):
+    """
+    Runs func, which queries the database, from async code.
+
+    Served from santex_test/asgi.py, DATABASE_THREAD_POOL is set and func runs in
+    the thread pool of asgiref, ASGI_THREADS threads, so requests query the
+    database in parallel. Every thread keeps its own connection, closed as a
+    request would once it is older than CONN_MAX_AGE or broken. Otherwise func
+    runs in the thread of the sync caller, with its connection and transaction.
+    """
+
+    @wraps(func)
+    def pooled(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def inner(*args, **kwargs):
+        if settings.DATABASE_THREAD_POOL:
+            return await sync_to_async(pooled, thread_sensitive=False)(*args, **kwargs)
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+    return inner
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    The ASGIHandler of Django 3.1 iterates streaming responses in the event loop,
+    where the database can not be queried, so the export fails under asgi.py.
+    This one takes every part of a streaming response in a thread of the response,
+    the server side cursor of the export stays on the connection of that thread,
+    and the loop serves other requests while a part is read.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": self.response_headers(response),
+            }
+        )
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as thread:
+            try:
+                parts = iter(response)
+                while True:
+                    part = await loop.run_in_executor(thread, next, parts, None)
+                    if part is None:
+                        break
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send(
+                            {
+                                "type": "http.response.body",
+                                "body": chunk,
+                                "more_body": True,
+                            }
+                        )
+                await send({"type": "http.response.body"})
+            finally:
+                await loop.run_in_executor(thread, self.close_response, response)
+
+    @staticmethod
+    def close_response(response) -> None:
+        # The thread goes away with the response, and so does its connection
+        try:
+            response.close()
+        finally:
+            connection.close()
+
+    @staticmethod
+    def response_headers(response) -> list:
+        headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()
+        )
+        return headers
@@ -0,0 +1,90 @@
+import io
+import time
+
+from itertools import islice
+from typing import Iterable, Iterator, List
+
+from django.db import connection
+
+
+def chunked(iterable: Iterable, size) -> Iterator[list]:
+    """
+    Splits the iterable in lists of up to size items, consuming it lazily
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def csv_value(value) -> str:
+    """
+    Renders a value for COPY in CSV format, where only unquoted empty values are
+    NULL, so strings are always quoted and empty strings survive
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class CSVReader(io.TextIOBase):
+    """
+    File like object that renders the rows as CSV while COPY reads them, so the
+    rows are never held in memory all at once
+    """
+
+    def __init__(self, rows: Iterable[tuple]) -> None:
+        self.rows = iter(rows)
+        self.count = 0
+        self._pending = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size=-1) -> str:
+        lines = [self._pending]
+        pending = len(self._pending)
+        while size < 0 or pending < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = ",".join(csv_value(value) for value in row) + "\n"
+            lines.append(line)
+            pending += len(line)
+            self.count += 1
+        self._pending = "".join(lines)
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def copy_insert(model, fields: List[str], rows: Iterable[tuple], metrics=None) -> int:
+    """
+    Inserts the rows into the table of the model with PostgreSQL COPY, which skips
+    the per row overhead of INSERT for large payloads. Rows hold the values of the
+    given fields, in order, and None is stored as NULL. They are streamed to the
+    database as they are consumed. Returns the rows inserted.
+
+    COPY goes around the execute wrappers of the connection, with metrics, an
+    api.metrics.ImportMetrics, it is recorded as a query.
+    """
+    columns = ", ".join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    table = connection.ops.quote_name(model._meta.db_table)
+
+    reader = CSVReader(rows)
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", reader
+        )
+    if metrics is not None:
+        metrics.record_query(time.perf_counter() - started)
+    return reader.count
@@ -0,0 +1,75 @@
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.football_data import PlayerRecord
+from api.models import ImportCheckpoint
+
+
+class Checkpoints:
+    """
+    The payloads already fetched for a league by imports that failed before
+    persisting it: the competition, its teams and every squad. Checkpoints older
+    than max_age seconds, IMPORT_CHECKPOINT_MAX_AGE by default, are dropped
+    instead of resumed, the league may have changed since.
+    """
+
+    def __init__(self, league_code, max_age=None) -> None:
+        self.league_code = league_code
+        if max_age is None:
+            max_age = settings.IMPORT_CHECKPOINT_MAX_AGE
+        rows = ImportCheckpoint.objects.filter(league_code=league_code)
+        expired_before = timezone.now() - timedelta(seconds=max_age)
+        rows.filter(created_at__lt=expired_before).delete()
+        self.payloads = {(row.step, row.key): row.payload for row in rows}
+
+    def get(self, step, key=""):
+        return self.payloads.get((step, str(key)))
+
+    def save(self, step, payload, key="") -> None:
+        # Imports of a league never overlap, see api.jobs.enqueue_import
+        ImportCheckpoint.objects.create(
+            league_code=self.league_code, step=step, key=str(key), payload=payload
+        )
+        self.payloads[(step, str(key))] = payload
+
+    def squads(self) -> Dict[int, List[PlayerRecord]]:
+        return {
+            int(key): [PlayerRecord(*player) for player in payload]
+            for (step, key), payload in self.payloads.items()
+            if step == ImportCheckpoint.SQUAD
+        }
+
+    def save_squads(self, squads: Dict[int, List[PlayerRecord]]) -> None:
+        """
+        Keeps the squads in a single insert, PlayerRecords are stored as lists
+        """
+        fresh = {
+            team_id: squad
+            for team_id, squad in squads.items()
+            if (ImportCheckpoint.SQUAD, str(team_id)) not in self.payloads
+        }
+        ImportCheckpoint.objects.bulk_create(
+            [
+                ImportCheckpoint(
+                    league_code=self.league_code,
+                    step=ImportCheckpoint.SQUAD,
+                    key=str(team_id),
+                    payload=[list(player) for player in squad],
+                )
+                for team_id, squad in fresh.items()
+            ],
+            ignore_conflicts=True,
+        )
+        for team_id, squad in fresh.items():
+            self.payloads[(ImportCheckpoint.SQUAD, str(team_id))] = squad
+
+
+def clear_checkpoints(league_code) -> None:
+    """
+    Forgets the payloads of a league once persisted, meant to run in the
+    transaction persisting it so a failure keeps them
+    """
+    ImportCheckpoint.objects.filter(league_code=league_code).delete()
@@ -0,0 +1,228 @@
+import json
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+
+from api.bulk import copy_insert
+from api.football_data import PlayerRecord, compact_squad
+from api.importer import PLAYER_FIELDS, LeagueImporter, refresh_player_counts
+from api.models import Competition, Player, Team
+from api.stats import refresh_league_summaries
+
+
+class FootballDump:
+    """
+    Responses of football-data.org saved to a directory under the paths of the
+    api: competitions/<code>.json, competitions/<id>/teams.json and
+    teams/<id>.json, the latter with the squad of the team. It answers like
+    FootballData does, so LeagueImporter maps it the same way.
+    """
+
+    def __init__(self, directory) -> None:
+        self.directory = Path(directory)
+
+    def read(self, *parts):
+        with open(self.directory.joinpath(*parts), "rb") as dump_file:
+            return json.load(dump_file)
+
+    def competition_codes(self) -> List[str]:
+        return sorted(path.stem for path in self.directory.glob("competitions/*.json"))
+
+    def get_competition(self, code) -> dict:
+        return self.read("competitions", f"{code}.json")
+
+    def get_competitions_teams(self, competition_id) -> List[dict]:
+        return self.read("competitions", str(competition_id), "teams.json")["teams"]
+
+    def has_squad(self, team_id) -> bool:
+        return self.directory.joinpath("teams", f"{team_id}.json").exists()
+
+    def get_team_players(self, team_id) -> List[PlayerRecord]:
+        return compact_squad(self.read("teams", f"{team_id}.json").get("squad"))
+
+
+@contextmanager
+def deferred_indexes(model):
+    """
+    Drops the indexes of the table of the model while the block runs and builds
+    them again after it, one sort per index instead of an update per row. Indexes
+    backing a constraint (the primary key, unique fields) are kept, the rows are
+    still checked against them.
+
+    The indexes are dropped for everyone, not in a transaction: the workers copy
+    from connections of their own, which a lock held until the rebuild would
+    block. Reads of the table go without them meanwhile, so this is only meant
+    for a database not serving yet.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT i.relname, pg_get_indexdef(i.oid)
+            FROM pg_index
+            JOIN pg_class i ON i.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = %s::regclass
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conindid = pg_index.indexrelid
+            )
+            """,
+            [table],
+        )
+        indexes = cursor.fetchall()
+        for name, _ in indexes:
+            cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+    try:
+        yield [name for name, _ in indexes]
+    finally:
+        # Not a check of the load, the dropped indexes back no constraint. Loaded
+        # inside a transaction, the foreign keys of the rows wait for its commit
+        # and PostgreSQL builds no index on a table with checks pending, so they
+        # are run now. In autocommit there are none and this does nothing.
+        connection.check_constraints()
+        with connection.cursor() as cursor:
+            for _, definition in indexes:
+                cursor.execute(definition)
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+
+
+def load_squads(directory, teams: List[Tuple[int, int]]) -> int:
+    """
+    Copies the squads of the teams, pairs of primary key and football-data.org id,
+    from the dump. Squad files are read one at a time and their players streamed
+    to COPY, in a transaction of its own. Returns the players loaded.
+    """
+    dump = FootballDump(directory)
+    importer = LeagueImporter(dump)
+    rows = (
+        row
+        for pk, external_id in teams
+        for row in importer.player_rows(dump.get_team_players(external_id), pk)
+    )
+    with transaction.atomic():
+        return copy_insert(Player, PLAYER_FIELDS, rows)
+
+
+def split(items: list, parts) -> List[list]:
+    return [chunk for chunk in (items[n::parts] for n in range(parts)) if chunk]
+
+
+class DumpLoader:
+    """
+    Loads the leagues of a FootballDump not imported yet. Competitions and teams
+    are few, they are written by this process in one transaction. Players are
+    copied by workers processes, each with its connection, with defer_indexes
+    while the indexes of the players table are dropped. Leagues end up as an
+    import would leave them: teams shared with leagues already stored are linked,
+    not loaded again.
+    """
+
+    def __init__(self, dump: FootballDump, workers=1, defer_indexes=False) -> None:
+        self.dump = dump
+        self.workers = workers
+        self.defer_indexes = defer_indexes
+        self.importer = LeagueImporter(dump)
+
+    def load(self) -> Dict[str, object]:
+        stored_codes = set(Competition.objects.values_list("code", flat=True))
+        codes = [c for c in self.dump.competition_codes() if c not in stored_codes]
+        with transaction.atomic():
+            competitions, teams = self.load_teams(codes)
+        squads = [
+            (team.pk, team.external_id)
+            for team in teams
+            if self.dump.has_squad(team.external_id)
+        ]
+
+        try:
+            if self.defer_indexes:
+                with deferred_indexes(Player):
+                    players = self.load_players(squads)
+            else:
+                players = self.load_players(squads)
+        except BaseException:
+            # Nothing is left half loaded, deleting the teams deletes their players
+            with transaction.atomic():
+                Team.objects.filter(pk__in=[team.pk for team in teams]).delete()
+                Competition.objects.filter(
+                    pk__in=[competition.pk for competition in competitions]
+                ).delete()
+            raise
+
+        with transaction.atomic():
+            loaded = Competition.objects.filter(
+                pk__in=[competition.pk for competition in competitions]
+            )
+            refresh_player_counts(loaded)
+            refresh_league_summaries(loaded)
+            loaded.update(refreshed_at=timezone.now())
+
+        return {
+            "leagues": codes,
+            "skipped": sorted(stored_codes & set(self.dump.competition_codes())),
+            "teams": len(teams),
+            "players": players,
+        }
+
+    def load_teams(self, codes) -> Tuple[List[Competition], List[Team]]:
+        """
+        Stores the competitions and the teams not stored yet, returns both
+        """
+        raw_competitions = [self.dump.get_competition(code) for code in codes]
+        competitions = Competition.objects.bulk_create(
+            [self.importer.build_competition(rc) for rc in raw_competitions]
+        )
+
+        teams_of = {}
+        raw_teams = {}
+        for competition in competitions:
+            league_teams = self.dump.get_competitions_teams(competition.external_id)
+            teams_of[competition] = [rt["id"] for rt in league_teams]
+            for rt in league_teams:
+                raw_teams.setdefault(rt["id"], rt)
+
+        teams = {
+            team.external_id: team
+            for team in Team.objects.filter(external_id__in=list(raw_teams))
+        }
+        new_teams = Team.objects.bulk_create(
+            self.importer.build_teams(
+                [rt for team_id, rt in raw_teams.items() if team_id not in teams]
+            ),
+            batch_size=settings.IMPORT_BATCH_SIZE,
+        )
+        teams.update((team.external_id, team) for team in new_teams)
+
+        Through = Team.competitions.through
+        Through.objects.bulk_create(
+            [
+                Through(team=teams[team_id], competition=competition)
+                for competition, team_ids in teams_of.items()
+                for team_id in dict.fromkeys(team_ids)
+            ],
+            batch_size=settings.IMPORT_BATCH_SIZE,
+        )
+
+        return competitions, new_teams
+
+    def load_players(self, squads: List[Tuple[int, int]]) -> int:
+        directory = str(self.dump.directory)
+        if self.workers <= 1 or len(squads) <= 1:
+            return load_squads(directory, squads)
+
+        # Forked workers must open connections of their own, not share this one
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            return sum(
+                pool.map(
+                    partial(load_squads, directory), split(squads, self.workers * 4)
+                )
+            )
@@ -0,0 +1,66 @@
+import csv
+import io
+
+from typing import Iterable, Iterator
+
+from django.conf import settings
+
+from api.bulk import chunked
+from api.models import Player, Team
+
+
+# Columns of every export, the related ones are joined in the same query
+EXPORTS = {
+    "players": (
+        Player,
+        "team__competitions__code",
+        [
+            "external_id",
+            "name",
+            "position",
+            "date_of_birth",
+            "country_of_birth",
+            "nationality",
+            "team__external_id",
+            "team__tla",
+            "team__name",
+        ],
+    ),
+    "teams": (
+        Team,
+        "competitions__code",
+        ["external_id", "name", "tla", "short_name", "area_name", "email"],
+    ),
+}
+
+
+def export_rows(league_code, table, chunk_size=None) -> Iterator[tuple]:
+    """
+    The rows of the table for the league, read from a server side cursor
+    chunk_size rows at a time so memory stays flat however big the league is
+    """
+    model, league_field, fields = EXPORTS[table]
+    return (
+        model.objects.filter(**{league_field: league_code})
+        .order_by("id")
+        .values_list(*fields)
+        .iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+    )
+
+
+def export_csv(league_code, table, chunk_size=None) -> Iterator[str]:
+    """
+    Renders the export as CSV, a header and then a piece of text for every
+    chunk_size rows
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    header = [field.replace("__", "_") for field in EXPORTS[table][2]]
+    yield render_csv([header])
+    for rows in chunked(export_rows(league_code, table, chunk_size), chunk_size):
+        yield render_csv(rows)
+
+
+def render_csv(rows: Iterable[Iterable]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
@@ -0,0 +1,199 @@
+import json
+import re
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from api.rate_limit import TokenBucket
+
+
+class FakeFootballData:
+    """
+    A local stand-in for football-data.org serving synthetic leagues, so imports
+    can be benchmarked without spending the quota of a token.
+
+    leagues maps the league codes to the number of teams they have. Every response
+    is delayed by latency seconds. With requests_per_window set the server counts
+    the requests like football-data.org does, telling how many are left and when
+    the counter resets, and answers 429 once they run out.
+    """
+
+    def __init__(
+        self,
+        leagues: Dict[str, int],
+        players_per_team=25,
+        latency=0.0,
+        requests_per_window: Optional[int] = None,
+        window=60.0,
+    ) -> None:
+        self.leagues = {
+            code: (1000 + n, teams) for n, (code, teams) in enumerate(leagues.items())
+        }
+        self.players_per_team = players_per_team
+        self.latency = latency
+        self.requests_per_window = requests_per_window
+        self.window = window
+        self.stats = Counter(requests=0, rate_limited=0)
+        self._lock = threading.Lock()
+        self._window_started_at = time.monotonic()
+        self._window_requests = 0
+        self._server: Optional[FakeServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v2"
+
+    def start(self) -> "FakeFootballData":
+        self._server = FakeServer(("127.0.0.1", 0), FakeHandler)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "FakeFootballData":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def count_request(self) -> Tuple[bool, dict]:
+        """
+        Counts a request, returns whether it is rate limited and the rate limit
+        headers of its response
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.requests_per_window is None:
+                return False, {}
+            now = time.monotonic()
+            if now - self._window_started_at >= self.window:
+                self._window_started_at = now
+                self._window_requests = 0
+            reset = self._window_started_at + self.window - now
+            limited = self._window_requests >= self.requests_per_window
+            if limited:
+                self.stats["rate_limited"] += 1
+            else:
+                self._window_requests += 1
+            return limited, {
+                TokenBucket.AVAILABLE_HEADER: (
+                    self.requests_per_window - self._window_requests
+                ),
+                TokenBucket.RESET_HEADER: f"{reset:.3f}",
+            }
+
+    def competition(self, code) -> Optional[dict]:
+        if code not in self.leagues:
+            return None
+        competition_id, _ = self.leagues[code]
+        return {
+            "id": competition_id,
+            "name": f"Synthetic League {code}",
+            "code": code,
+            "area": {"id": 1, "name": "Benchland"},
+        }
+
+    def teams(self, competition_id) -> Optional[dict]:
+        for league_id, teams in self.leagues.values():
+            if league_id == competition_id:
+                return {
+                    "teams": [
+                        self.team(league_id * 1000 + n, squad=False)
+                        for n in range(teams)
+                    ]
+                }
+        return None
+
+    def team(self, team_id, squad=True) -> dict:
+        team = {
+            "id": team_id,
+            "name": f"Synthetic Team {team_id}",
+            "shortName": f"Team {team_id}",
+            "tla": f"T{team_id}",
+            "area": {"id": 1, "name": "Benchland"},
+            "email": f"team{team_id}@example.com",
+        }
+        if squad:
+            players = [
+                {
+                    "id": team_id * 100 + n,
+                    "name": f"Player {team_id}-{n}",
+                    "position": ["Goalkeeper", "Defender", "Midfielder", "Attacker"][
+                        n % 4
+                    ],
+                    "dateOfBirth": f"{1985 + n % 15}-0{1 + n % 9}-1{n % 10}T00:00:00Z",
+                    "countryOfBirth": "Benchland",
+                    "nationality": "Benchland",
+                    "role": "PLAYER",
+                }
+                for n in range(self.players_per_team)
+            ]
+            coach = {"id": team_id * 100 + 99, "name": "Coach", "role": "COACH"}
+            team["squad"] = players + [coach]
+        return team
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Squads are fetched by many clients at once, the default backlog of 5 would
+    # drop their connections
+    request_queue_size = 1024
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    # Keeps the connections alive, as the real api does
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        (re.compile(r"^/v2/competitions/(\d+)/teams$"), "teams"),
+        (re.compile(r"^/v2/competitions/([^/]+)$"), "competition"),
+        (re.compile(r"^/v2/teams/(\d+)$"), "team"),
+    ]
+
+    def do_GET(self) -> None:
+        fake: FakeFootballData = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        limited, headers = fake.count_request()
+        if limited:
+            self.respond(429, {"message": "Rate limited"}, headers)
+            return
+
+        for pattern, resource in self.ROUTES:
+            match = pattern.match(self.path)
+            if match:
+                key = match.group(1)
+                if resource != "competition":
+                    key = int(key)
+                body = getattr(fake, resource)(key)
+                break
+        else:
+            body = None
+        if body is None:
+            self.respond(404, {"message": "Not found"}, headers)
+        else:
+            self.respond(200, body, headers)
+
+    def respond(self, status, body, headers) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args) -> None:
+        pass
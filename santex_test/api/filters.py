@@ -0,0 +1,31 @@
+import django_filters
+
+from api.models import Competition, Player, Team
+
+
+class CompetitionFilter(django_filters.FilterSet):
+    area = django_filters.CharFilter(field_name="area_name")
+
+    class Meta:
+        model = Competition
+        fields = ["code", "area"]
+
+
+class TeamFilter(django_filters.FilterSet):
+    area = django_filters.CharFilter(field_name="area_name")
+    # Code of a competition the team plays
+    competition = django_filters.CharFilter(field_name="competitions__code")
+
+    class Meta:
+        model = Team
+        fields = ["tla", "area", "competition"]
+
+
+class PlayerFilter(django_filters.FilterSet):
+    # Area of the team of the player
+    area = django_filters.CharFilter(field_name="team__area_name")
+    competition = django_filters.CharFilter(field_name="team__competitions__code")
+
+    class Meta:
+        model = Player
+        fields = ["nationality", "position", "area", "team", "competition"]
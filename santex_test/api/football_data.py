@@ -1,26 +1,160 @@
-import requests
+import asyncio
+import logging
+import os
+import threading
 import time
 
+import httpx
+import requests
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import wraps
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RetryError
 
+from api.http_cache import CacheEntry, endpoint_of, get_response_cache
+from api.rate_limit import TokenPool
+
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerRecord(NamedTuple):
+    """
+    What we keep of a squad member, only players are kept
+    """
+
+    name: str
+    position: Optional[str]
+    date_of_birth: Optional[str]
+    country_of_birth: Optional[str]
+    nationality: Optional[str]
+    id: Optional[int] = None
+
+
+def compact_squad(squad: Optional[List[dict]]) -> List[PlayerRecord]:
+    """
+    Drops coaches and staff, and every field of the players we do not store, as
+    soon as the squad is fetched
+    """
+    return [
+        PlayerRecord(
+            name=p.get("name"),
+            position=p.get("position"),
+            date_of_birth=p.get("dateOfBirth"),
+            country_of_birth=p.get("countryOfBirth"),
+            nationality=p.get("nationality"),
+            id=p.get("id"),
+        )
+        for p in squad or []
+        if p.get("role") == "PLAYER"
+    ]
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def build_session(pool_size) -> requests.Session:
+    """
+    Builds a keep-alive session whose connection pool holds up to pool_size
+    connections to football-data.org. The pool blocks instead of opening extra
+    connections that would be thrown away after a single request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {
+            "content-type": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        }
+    )
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the session shared by every FootballData in this process, so the
+    connections are reused across calls and imports. Connections can not be shared
+    with forked processes, each one builds its own session.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = build_session(settings.FOOTBALL_DATA_POOL_SIZE)
+            _session_pid = os.getpid()
+        return _session
+
+
+def refuses_the_key(response) -> bool:
+    """
+    Whether football-data.org refused the token itself, "Your API token is
+    invalid.", rather than a resource out of the plan of the token, which is
+    answered with a 403 as well
+    """
+    if response.status_code not in (400, 401, 403):
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    message = str(body.get("message", "")).lower() if isinstance(body, dict) else ""
+    return "token" in message and "invalid" in message
+
 
 def handle_rate_limit(func):
     """
-    This decorator catches 429 errors and retries 5 times. After that it gives up
-    raising an exception
+    This decorator paces the requests with the token buckets of the api keys, so we
+    wait before hitting the rate limit instead of after, and hands the request the
+    key to make it with. If we still get a 429 the next attempt waits only until
+    the server resets the counter of the key, or takes another key. A key the
+    server says is invalid is taken out of rotation while there are others. After
+    5 attempts it gives up raising an exception
     """
-    def inner(*args, **kwargs):
+
+    @wraps(func)
+    def inner(self, *args, **kwargs):
         attempts = 0
         while attempts < 5:
+            key, waited = self.tokens.acquire()
+            if self.metrics is not None:
+                self.metrics.record_wait(waited)
             try:
-                result = func(*args, **kwargs)
+                result = func(self, key, *args, **kwargs)
                 return result
             except requests.HTTPError as ex:
-                if ex.response.status_code == 429:
-                    attempts += 1
-                    time.sleep(60)
-                else:
+                if not self._retry(key, ex.response):
+                    raise ex
+                attempts += 1
+        raise RetryError("Retry exceeded after being rate limited")
+
+    return inner
+
+
+def handle_rate_limit_async(func):
+    """
+    handle_rate_limit for the coroutines of AsyncFootballData
+    """
+
+    @wraps(func)
+    async def inner(self, *args, **kwargs):
+        attempts = 0
+        while attempts < 5:
+            key, waited = await self.tokens.acquire_async()
+            if self.metrics is not None:
+                self.metrics.record_wait(waited)
+            try:
+                return await func(self, key, *args, **kwargs)
+            except httpx.HTTPStatusError as ex:
+                if not self._retry(key, ex.response):
                     raise ex
+                attempts += 1
         raise RetryError("Retry exceeded after being rate limited")
 
     return inner
@@ -28,28 +162,138 @@ def handle_rate_limit(func):
 
 class FootballData:
 
-    BASE_URL = "https://api.football-data.org/v2"
     AUTH_HEADER = "X-Auth-Token"
 
-    def __init__(self, api_key) -> None:
-        self.key = api_key
+    def __init__(
+        self,
+        api_key,
+        requests_per_minute=None,
+        session=None,
+        timeout=None,
+        cache=None,
+        revalidate=False,
+        base_url=None,
+        metrics=None,
+        pool_keys=(),
+    ) -> None:
+        """
+        api_key is a token, or a list of them to spread the requests over, each
+        allowed requests_per_minute. The pool_keys are spread over too, but only
+        once the server answered a request made with api_key. With revalidate set,
+        cached responses are always revalidated with the server even while they are
+        fresh, for when the data must be up to date. With metrics, an
+        api.metrics.ImportMetrics, every request, retry and rate limit wait is
+        recorded.
+        """
+        api_keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.base_url = base_url or settings.FOOTBALL_DATA_URL
+        self.requests_per_minute = (
+            requests_per_minute or settings.FOOTBALL_DATA_REQUESTS_PER_MINUTE
+        )
+        self.tokens = TokenPool(api_keys, self.requests_per_minute, pool_keys)
+        self.session = session or get_session()
+        self.timeout = timeout or (
+            settings.FOOTBALL_DATA_CONNECT_TIMEOUT,
+            settings.FOOTBALL_DATA_READ_TIMEOUT,
+        )
+        self.cache = cache or get_response_cache()
+        self.revalidate = revalidate
+        self.metrics = metrics
+
+    def _make_the_request(self, url):
+        cached, servable = self._lookup(url)
+        if servable:
+            return cached.body
+        return self._fetch(url, cached)
 
     @handle_rate_limit
-    def _make_the_request(self, url):
-        response = requests.get(
-            url,
-            headers={
-                "content-type": "application/json",
-                self.AUTH_HEADER: self.key,
-            },
+    def _fetch(self, key, url, cached: CacheEntry = None):
+        started = time.perf_counter()
+        response = self.session.get(
+            url, headers=self._request_headers(key, cached), timeout=self.timeout
         )
+        return self._handle_response(key, url, cached, response, started)
+
+    def _retry(self, key, response) -> bool:
+        """
+        Handles a request rate limited or refused, returns whether to retry it. A
+        resource out of the plan of the key fails the request, the key stays.
+        """
+        if response.status_code == 429:
+            self.tokens.bucket(key).exhaust()
+        elif refuses_the_key(response) and len(self.tokens.buckets) > 1:
+            cooldown = settings.FOOTBALL_DATA_FORBIDDEN_KEY_COOLDOWN
+            others_left = self.tokens.refuse(key, cooldown)
+            logger.warning(
+                "Api key taken out of rotation",
+                extra={"api_key": f"...{key[-4:]}", "seconds": cooldown},
+            )
+            if not others_left:
+                return False
+        else:
+            return False
+        if self.metrics is not None:
+            self.metrics.record_retry()
+        return True
+
+    def _fan_out(self, requests) -> int:
+        """
+        Requests worth making at once, more would only wait for a token or for a
+        connection
+        """
+        return max(
+            1, min(requests, self.tokens.capacity, settings.FOOTBALL_DATA_POOL_SIZE)
+        )
+
+    def _lookup(self, url) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Returns the cached response of the url, and whether it can be served without
+        asking the server
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        servable = cached is not None and cached.fresh and not self.revalidate
+        if servable and self.metrics is not None:
+            self.metrics.record_cache_hit(endpoint_of(url))
+        return cached, servable
+
+    def _request_headers(self, key, cached: Optional[CacheEntry]) -> dict:
+        headers = {self.AUTH_HEADER: key}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def _handle_response(
+        self, key, url, cached: Optional[CacheEntry], response, started
+    ):
+        """
+        Records and unpacks a response of requests or httpx, they share the api
+        """
+        if self.metrics is not None:
+            self.metrics.record_request(
+                endpoint_of(url),
+                response.status_code,
+                time.perf_counter() - started,
+                len(response.content),
+            )
+        self.tokens.bucket(key).update_from_headers(response.headers)
+        if response.status_code < 400:
+            self.tokens.admit_pool()
+        if response.status_code == 304 and cached is not None:
+            self.cache.revalidated(cached)
+            return cached.body
+
         response.raise_for_status()
-        return response.json()
+        body = response.json()
+        if self.cache is not None:
+            self.cache.set(url, body, response.headers)
+        return body
 
     def get_competition(self, code):
         # http://api.football-data.org/v2/competitions/PL
         try:
-            url = f"{self.BASE_URL}/competitions/{code}"
+            url = f"{self.base_url}/competitions/{code}"
             response = self._make_the_request(url)
             return response
         except requests.HTTPError as ex:
@@ -60,7 +304,7 @@ class FootballData:
     def get_competitions_teams(self, competition_id):
         # https://api.football-data.org/v2/competitions/PL/teams
         try:
-            url = f"{self.BASE_URL}/competitions/{competition_id}/teams"
+            url = f"{self.base_url}/competitions/{competition_id}/teams"
             response = self._make_the_request(url)
             return response.get("teams")
         except requests.HTTPError as ex:
@@ -74,7 +318,7 @@ class FootballData:
     def get_team_squad(self, team_id):
         # https://api.football-data.org/v2/teams/18
         try:
-            url = f"{self.BASE_URL}/teams/{team_id}"
+            url = f"{self.base_url}/teams/{team_id}"
             response = self._make_the_request(url)
             return response.get("squad")
         except requests.HTTPError as ex:
@@ -83,6 +327,172 @@ class FootballData:
             else:
                 raise ex
 
+    def get_team_players(self, team_id) -> List[PlayerRecord]:
+        return compact_squad(self.get_team_squad(team_id))
+
+    def get_squads(
+        self, team_ids: List[int], fetched: Dict[int, List[PlayerRecord]] = None
+    ) -> Dict[int, List[PlayerRecord]]:
+        """
+        Fetches the players of the given teams concurrently and maps them by team id.
+        There is no point in running more workers than requests the tokens are
+        allowed to do in a minute, nor than connections the session keeps, so the
+        pool is bounded by both.
+
+        The squads are added to fetched, when given, even if another one fails: the
+        caller keeps them while the exception goes up.
+        """
+        fetched = {} if fetched is None else fetched
+        if not team_ids:
+            return fetched
+
+        workers = self._fan_out(len(team_ids))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            executor.submit(self.get_team_players, team_id): team_id
+            for team_id in team_ids
+        }
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except Exception:
+            # Do not keep spending the quota on the squads not requested yet
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            for future, team_id in futures.items():
+                if not future.cancelled() and future.exception() is None:
+                    fetched[team_id] = future.result()
+        return fetched
+
+    def get_teams_squads(self, teams: List[dict]) -> Dict[str, List[PlayerRecord]]:
+        """
+        Fetches the players of the given teams concurrently and maps them by the team
+        tla
+        """
+        squads = self.get_squads([team["id"] for team in teams])
+        return {team["tla"]: squads[team["id"]] for team in teams}
+
+
+class AsyncFootballData(FootballData):
+    """
+    FootballData for async code. Requests wait on the event loop instead of holding
+    a thread, and so do the rate limit waits. It shares the rate limiters of the
+    api keys and the response cache with FootballData. Requests are made within
+    async with, which opens and closes its connections.
+    """
+
+    def __init__(self, api_key, **kwargs) -> None:
+        super().__init__(api_key, **kwargs)
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self) -> "AsyncFootballData":
+        pool_size = settings.FOOTBALL_DATA_POOL_SIZE
+        connect, read = self.timeout
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(read, connect=connect),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.client.aclose()
+        self.client = None
+
+    async def _make_the_request(self, url):
+        # Cache files are small, reading them does not hold the loop for long
+        cached, servable = self._lookup(url)
+        if servable:
+            return cached.body
+        return await self._fetch(url, cached)
+
+    @handle_rate_limit_async
+    async def _fetch(self, key, url, cached: CacheEntry = None):
+        started = time.perf_counter()
+        response = await self.client.get(
+            url, headers=self._request_headers(key, cached)
+        )
+        return self._handle_response(key, url, cached, response, started)
+
+    async def get_competition(self, code):
+        try:
+            url = f"{self.base_url}/competitions/{code}"
+            return await self._make_the_request(url)
+        except httpx.HTTPStatusError as ex:
+            if ex.response.status_code in (400, 404):
+                raise CompetitionNotFound(code)
+            raise ex
+
+    async def get_competitions_teams(self, competition_id):
+        try:
+            url = f"{self.base_url}/competitions/{competition_id}/teams"
+            response = await self._make_the_request(url)
+            return response.get("teams")
+        except httpx.HTTPStatusError as ex:
+            if ex.response.status_code != 429:
+                raise CompetitionsTeamsError(
+                    f"Failed to retrieve Teams for the Competition {competition_id}"
+                )
+            raise ex
+
+    async def get_team_squad(self, team_id):
+        try:
+            url = f"{self.base_url}/teams/{team_id}"
+            response = await self._make_the_request(url)
+            return response.get("squad")
+        except httpx.HTTPStatusError as ex:
+            if ex.response.status_code != 429:
+                raise TeamError(f"Failed to retrieve Team {team_id}")
+            raise ex
+
+    async def get_team_players(self, team_id) -> List[PlayerRecord]:
+        return compact_squad(await self.get_team_squad(team_id))
+
+    async def get_squads(
+        self, team_ids: List[int], fetched: Dict[int, List[PlayerRecord]] = None
+    ) -> Dict[int, List[PlayerRecord]]:
+        """
+        Fetches the players of the given teams concurrently, as many at once as the
+        tokens are allowed to request in a minute and the client keeps connections,
+        and maps them by team id. Like FootballData.get_squads, fetched keeps the
+        squads that arrived when another one fails, the requests in flight then
+        are waited for.
+        """
+        fetched = {} if fetched is None else fetched
+        if not team_ids:
+            return fetched
+
+        slots = asyncio.Semaphore(self._fan_out(len(team_ids)))
+        requested = set()
+
+        async def get_players(team_id):
+            async with slots:
+                requested.add(team_id)
+                return await self.get_team_players(team_id)
+
+        tasks = {
+            team_id: asyncio.ensure_future(get_players(team_id)) for team_id in team_ids
+        }
+        try:
+            await asyncio.gather(*tasks.values())
+        except Exception:
+            # Do not keep spending the quota on the squads not requested yet, the
+            # ones requested are paid for already
+            for team_id, task in tasks.items():
+                if team_id not in requested:
+                    task.cancel()
+            raise
+        finally:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for team_id, task in tasks.items():
+                if not task.cancelled() and task.exception() is None:
+                    fetched[team_id] = task.result()
+        return fetched
+
 
 class CompetitionNotFound(Exception):
     pass
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+
+# Endpoint name by url pattern, used to pick the time to live of the responses
+ENDPOINTS = [
+    ("squad", re.compile(r"/teams/\d+$")),
+    ("teams", re.compile(r"/competitions/[^/]+/teams$")),
+    ("competition", re.compile(r"/competitions/[^/]+$")),
+]
+
+
+def endpoint_of(url) -> Optional[str]:
+    for endpoint, pattern in ENDPOINTS:
+        if pattern.search(url):
+            return endpoint
+    return None
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    body: dict
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+    fresh: bool = False
+
+
+class ResponseCache:
+    """
+    Keeps the football-data.org responses on local disk, one json file per url.
+
+    Entries are fresh for the time to live of their endpoint. Stale entries are
+    still returned so the request can be revalidated with If-None-Match and
+    If-Modified-Since. Once there are a tenth more than max_entries files the least
+    recently used ones are removed, down to max_entries. The files are counted as
+    they are written, the directory is only scanned to evict them.
+    """
+
+    def __init__(self, directory, max_entries, ttls: Dict[str, int]) -> None:
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.ttls = ttls
+        self.stats = Counter(hits=0, misses=0, revalidations=0)
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._entries = len(self._files())
+        self._evicting = False
+
+    def ttl(self, url) -> int:
+        return self.ttls.get(endpoint_of(url), 0)
+
+    def get(self, url) -> Optional[CacheEntry]:
+        path = self._path(url)
+        try:
+            with open(path) as cached:
+                entry = CacheEntry(**json.load(cached))
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        except (ValueError, TypeError):
+            # A half written or outdated file, it is refetched and overwritten
+            self._count("misses")
+            return None
+
+        entry.fresh = time.time() - entry.stored_at < self.ttl(url)
+        self._count("hits" if entry.fresh else "misses")
+        try:
+            # Access time for the least recently used eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def set(self, url, body, headers) -> None:
+        entry = CacheEntry(
+            url=url,
+            body=body,
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            stored_at=time.time(),
+        )
+        if self._write(entry):
+            self._added()
+
+    def revalidated(self, entry: CacheEntry) -> None:
+        """
+        The server told us the entry did not change, it is fresh for another ttl
+        """
+        entry.stored_at = time.time()
+        self._write(entry)
+        self._count("revalidations")
+
+    def _path(self, url) -> Path:
+        return self.directory / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _write(self, entry: CacheEntry) -> bool:
+        """
+        Writes the entry, returns whether its file is a new one
+        """
+        path = self._path(entry.url)
+        new = not path.exists()
+        partial = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(partial, "w") as cached:
+            json.dump(
+                {
+                    "url": entry.url,
+                    "body": entry.body,
+                    "etag": entry.etag,
+                    "last_modified": entry.last_modified,
+                    "stored_at": entry.stored_at,
+                },
+                cached,
+            )
+        os.replace(partial, path)
+        return new
+
+    def _files(self) -> List[os.DirEntry]:
+        return [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".json")
+        ]
+
+    def _added(self) -> None:
+        """
+        Counts a new file and evicts once they are past the high water mark. One
+        thread evicts while the others go on writing.
+        """
+        with self._lock:
+            self._entries += 1
+            if self._evicting or self._entries <= self.max_entries * 1.1:
+                return
+            self._evicting = True
+            counted = self._entries
+        kept = None
+        try:
+            kept = self._evict()
+        finally:
+            with self._lock:
+                self._evicting = False
+                if kept is not None:
+                    # Files written meanwhile are counted on top of the ones kept
+                    self._entries = kept + self._entries - counted
+
+    def _evict(self) -> int:
+        """
+        Removes the least recently used files down to max_entries, returns the files
+        left. Other processes may share the directory, so it is scanned rather than
+        trusting the count.
+        """
+        entries = self._files()
+        if len(entries) <= self.max_entries:
+            return len(entries)
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for stale in entries[: len(entries) - self.max_entries]:
+            try:
+                os.remove(stale.path)
+            except FileNotFoundError:
+                pass
+        return self.max_entries
+
+    def _count(self, stat) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+
+_caches: Dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Returns the cache of the configured directory, None when caching is disabled
+    """
+    directory = settings.FOOTBALL_DATA_CACHE_DIR
+    if not directory:
+        return None
+    with _caches_lock:
+        key = str(directory)
+        if key not in _caches:
+            _caches[key] = ResponseCache(
+                directory,
+                settings.FOOTBALL_DATA_CACHE_MAX_ENTRIES,
+                settings.FOOTBALL_DATA_CACHE_TTLS,
+            )
+        return _caches[key]
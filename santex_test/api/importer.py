@@ -0,0 +1,521 @@
+import logging
+
+from collections import Counter
+from datetime import datetime, time
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from api.async_db import database_sync_to_async
+from api.bulk import chunked, copy_insert
+from api.checkpoints import Checkpoints
+from api.football_data import FootballData, PlayerRecord
+from api.metrics import counting, measure
+from api.models import Competition, ImportCheckpoint, Team, Player
+from api.player_counts import forget_total_players
+from api.stats import refresh_league_summaries
+
+
+logger = logging.getLogger(__name__)
+
+
+# Player columns written by the COPY fast path
+PLAYER_FIELDS = [
+    "name",
+    "position",
+    "date_of_birth",
+    "country_of_birth",
+    "nationality",
+    "team_id",
+    "external_id",
+]
+
+# Fields a sync compares and updates
+TEAM_SYNC_FIELDS = ["name", "tla", "short_name", "area_name", "email"]
+PLAYER_SYNC_FIELDS = [
+    "name",
+    "position",
+    "date_of_birth",
+    "country_of_birth",
+    "nationality",
+]
+
+
+class PlayerRows:
+    """
+    Turns squads into rows of PLAYER_FIELDS, ready for COPY or bulk_create, a
+    column at a time instead of a Player at a time. Text is stripped and cut to
+    the max_length of its field, and each distinct date of birth is parsed once
+    for all the squads given to the same PlayerRows. Values cut, and dates that
+    can not be parsed and are stored as null, are logged and counted in cut and
+    unparsed.
+    """
+
+    TEXT_FIELDS = ["name", "position", "country_of_birth", "nationality"]
+
+    def __init__(self) -> None:
+        self.dates = {}
+        self.max_lengths = {
+            field: Player._meta.get_field(field).max_length
+            for field in self.TEXT_FIELDS
+        }
+        self.cut = Counter()
+        self.unparsed = 0
+
+    def __call__(self, raw_players: List[PlayerRecord], team_id) -> List[tuple]:
+        if not raw_players:
+            return []
+        names, positions, dates, countries, nationalities, ids = zip(*raw_players)
+        columns = {
+            "name": self.text(names, "name"),
+            "position": self.text(positions, "position"),
+            "date_of_birth": self.datetimes(dates),
+            "country_of_birth": self.text(countries, "country_of_birth"),
+            "nationality": self.text(nationalities, "nationality"),
+            "team_id": [team_id] * len(ids),
+            "external_id": ids,
+        }
+        return list(zip(*[columns[field] for field in PLAYER_FIELDS]))
+
+    def text(self, values, field) -> list:
+        max_length = self.max_lengths[field]
+        stripped = [value if value is None else value.strip() for value in values]
+        for value in stripped:
+            if value is not None and len(value) > max_length:
+                self.cut[field] += 1
+                logger.warning(
+                    "Player field cut to its max_length",
+                    extra={"field": field, "value": value, "max_length": max_length},
+                )
+        return [value if value is None else value[:max_length] for value in stripped]
+
+    def datetimes(self, values) -> list:
+        for value in set(values).difference(self.dates):
+            self.dates[value] = self.parse_date_of_birth(value) if value else None
+        return [self.dates[value] for value in values]
+
+    def parse_date_of_birth(self, value) -> Optional[datetime]:
+        """
+        A datetime, as the v2 api sends them, or a date, as v4 does, stored at
+        midnight as a DateTimeField stores dates
+        """
+        try:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                day = parse_date(value)
+                if day is not None:
+                    parsed = timezone.make_aware(datetime.combine(day, time()))
+        except ValueError:
+            # Well formed but not a date, like 1993-02-30
+            parsed = None
+        if parsed is None:
+            self.unparsed += 1
+            logger.warning(
+                "Player date of birth not understood, stored as null",
+                extra={"value": value},
+            )
+        return parsed
+
+
+# Namespace of the advisory locks taken on football-data.org team ids
+TEAM_LOCK = 1
+
+
+def lock_teams(external_ids) -> None:
+    """
+    Locks the football-data.org team ids until the transaction ends, in order so
+    two imports never wait on each other. An import about to insert a team waits
+    for a concurrent one inserting it to commit, and then finds it stored.
+    """
+    ids = sorted({team_id for team_id in external_ids if team_id is not None})
+    if ids and connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, id) FROM unnest(%s::int[]) AS id",
+                [TEAM_LOCK, ids],
+            )
+
+
+def refresh_player_counts(competitions) -> None:
+    """
+    Recounts the denormalized player count of the competitions
+    """
+    for competition in competitions.annotate(players=Count("team__player")):
+        competition.player_count = competition.players
+        competition.save(update_fields=["player_count"])
+        transaction.on_commit(lambda code=competition.code: forget_total_players(code))
+
+
+class LeagueImporter:
+    """
+    Imports a league from football-data.org in two stages: extract_data pulls the
+    competition, its teams and their squads from the api, and persist_data writes
+    them, or sync_data updates a league already imported with them. Both are
+    expected to run inside a transaction. With metrics, an
+    api.metrics.ImportMetrics, each of their steps is measured.
+    """
+
+    def __init__(self, football_data: FootballData, metrics=None) -> None:
+        self.football_data = football_data
+        self.metrics = metrics
+        self.player_rows = PlayerRows()
+
+    def the_league_exists(self, code) -> bool:
+        return Competition.objects.filter(code=code).exists()
+
+    def extract_data(
+        self,
+        league_code,
+        known_squads=None,
+        skip_stored_teams=True,
+        checkpoint_max_age=None,
+    ) -> Tuple[List, List, List]:
+        """
+        known_squads maps team ids to the squads already fetched, only the missing
+        ones are requested and added to it. Leagues imported together share it so
+        teams playing in more than one of them are fetched once. Unless
+        skip_stored_teams is unset, the squads of the teams already stored for
+        another league are not fetched either, and are missing from raw_players.
+
+        Every payload is checkpointed as soon as it is fetched, squads included
+        when another one fails, and taken from the checkpoints by the next import
+        of the league instead of requested again, unless older than
+        checkpoint_max_age seconds. See api.checkpoints.
+        """
+        known_squads = {} if known_squads is None else known_squads
+        checkpoints = Checkpoints(league_code, checkpoint_max_age)
+        with measure(self.metrics, "extract.competition"):
+            raw_competition: dict = self.resume(
+                checkpoints, ImportCheckpoint.COMPETITION
+            )
+            if raw_competition is None:
+                raw_competition = self.football_data.get_competition(league_code)
+                checkpoints.save(ImportCheckpoint.COMPETITION, raw_competition)
+        with measure(self.metrics, "extract.teams"):
+            raw_teams: List[dict] = self.resume(checkpoints, ImportCheckpoint.TEAMS)
+            if raw_teams is None:
+                raw_teams = self.football_data.get_competitions_teams(
+                    raw_competition["id"]
+                )
+                checkpoints.save(ImportCheckpoint.TEAMS, raw_teams)
+        wanted = [team["id"] for team in raw_teams]
+        if skip_stored_teams:
+            wanted = self.not_stored(wanted)
+        with measure(self.metrics, "extract.squads"):
+            self.resume_squads(checkpoints, wanted, known_squads)
+            missing = [team_id for team_id in wanted if team_id not in known_squads]
+            try:
+                self.football_data.get_squads(missing, known_squads)
+            finally:
+                checkpoints.save_squads(self.squads_of(wanted, known_squads))
+        return raw_competition, raw_teams, self.squads_by_tla(raw_teams, known_squads)
+
+    async def extract_data_async(
+        self,
+        league_code,
+        known_squads=None,
+        skip_stored_teams=True,
+        checkpoint_max_age=None,
+    ) -> Tuple[List, List, List]:
+        """
+        extract_data for an AsyncFootballData, the squads are fetched on the event
+        loop instead of a pool of threads
+        """
+        known_squads = {} if known_squads is None else known_squads
+        checkpoints = await self.database(Checkpoints)(league_code, checkpoint_max_age)
+        save = self.database(checkpoints.save)
+        async with self.football_data:
+            with measure(self.metrics, "extract.competition"):
+                raw_competition = self.resume(checkpoints, ImportCheckpoint.COMPETITION)
+                if raw_competition is None:
+                    raw_competition = await self.football_data.get_competition(
+                        league_code
+                    )
+                    await save(ImportCheckpoint.COMPETITION, raw_competition)
+            with measure(self.metrics, "extract.teams"):
+                raw_teams = self.resume(checkpoints, ImportCheckpoint.TEAMS)
+                if raw_teams is None:
+                    raw_teams = await self.football_data.get_competitions_teams(
+                        raw_competition["id"]
+                    )
+                    await save(ImportCheckpoint.TEAMS, raw_teams)
+            wanted = [team["id"] for team in raw_teams]
+            if skip_stored_teams:
+                wanted = await self.database(self.not_stored)(wanted)
+            with measure(self.metrics, "extract.squads"):
+                self.resume_squads(checkpoints, wanted, known_squads)
+                missing = [team_id for team_id in wanted if team_id not in known_squads]
+                try:
+                    await self.football_data.get_squads(missing, known_squads)
+                finally:
+                    await self.database(checkpoints.save_squads)(
+                        self.squads_of(wanted, known_squads)
+                    )
+        return raw_competition, raw_teams, self.squads_by_tla(raw_teams, known_squads)
+
+    def database(self, func):
+        """
+        Runs func, which queries the database, from async code, its queries count
+        for the stages of the import
+        """
+        return database_sync_to_async(counting(self.metrics, func))
+
+    def resume(self, checkpoints: Checkpoints, step):
+        payload = checkpoints.get(step)
+        if payload is not None and self.metrics is not None:
+            self.metrics.record_resumed(1)
+        return payload
+
+    def resume_squads(self, checkpoints: Checkpoints, wanted, known_squads) -> None:
+        """
+        Adds the squads checkpointed for the wanted teams to known_squads
+        """
+        resumed = {
+            team_id: squad
+            for team_id, squad in checkpoints.squads().items()
+            if team_id in wanted and team_id not in known_squads
+        }
+        known_squads.update(resumed)
+        if resumed and self.metrics is not None:
+            self.metrics.record_resumed(len(resumed))
+
+    def squads_of(self, team_ids, known_squads) -> dict:
+        return {
+            team_id: known_squads[team_id]
+            for team_id in team_ids
+            if team_id in known_squads
+        }
+
+    def not_stored(self, team_ids: List[int]) -> List[int]:
+        stored = set(
+            Team.objects.filter(external_id__in=team_ids).values_list(
+                "external_id", flat=True
+            )
+        )
+        return [team_id for team_id in team_ids if team_id not in stored]
+
+    def squads_by_tla(self, raw_teams, known_squads) -> dict:
+        return {
+            team["tla"]: known_squads[team["id"]]
+            for team in raw_teams
+            if team["id"] in known_squads
+        }
+
+    def persist_data(self, raw_competition, raw_teams, raw_players) -> None:
+        """
+        Teams already stored for another league, and their players, are only linked
+        to the competition
+        """
+        with measure(self.metrics, "persist.competition"):
+            competition: Competition = self.build_competition(raw_competition)
+            competition.save()
+
+        with measure(self.metrics, "persist.teams"):
+            fresh_teams = self.build_teams(raw_teams)
+            lock_teams(team.external_id for team in fresh_teams)
+            stored = list(
+                Team.objects.filter(
+                    external_id__in=[team.external_id for team in fresh_teams]
+                )
+            )
+            stored_ids = {team.external_id for team in stored}
+            # PostgreSQL returns the primary keys of the teams, no need to query them
+            teams = Team.objects.bulk_create(
+                [team for team in fresh_teams if team.external_id not in stored_ids],
+                batch_size=settings.IMPORT_BATCH_SIZE,
+            )
+            # A new competition has no links yet, no need to look for them as add does
+            Through = Team.competitions.through
+            Through.objects.bulk_create(
+                [Through(team=t, competition=competition) for t in teams + stored],
+                batch_size=settings.IMPORT_BATCH_SIZE,
+            )
+
+        with measure(self.metrics, "persist.players"):
+            teams = [team for team in teams if team.tla in raw_players]
+            player_count = sum(len(raw_players[team.tla]) for team in teams)
+            # Rows are built a squad at a time while they are inserted
+            rows = (
+                row
+                for team in teams
+                for row in self.player_rows(raw_players[team.tla], team.pk)
+            )
+            self.insert_players(rows, player_count)
+
+        with measure(self.metrics, "persist.player_count"):
+            if stored:
+                player_count += Player.objects.filter(team__in=stored).count()
+            competition.player_count = player_count
+            competition.save(update_fields=["player_count"])
+            transaction.on_commit(lambda: forget_total_players(competition.code))
+
+        with measure(self.metrics, "persist.summary"):
+            refresh_league_summaries([competition])
+
+    def sync_data(self, raw_competition, raw_teams, raw_players) -> dict:
+        """
+        Brings an imported league up to date writing only what changed. Teams and
+        players are matched by their football-data.org id so the rows keep their
+        primary keys. Rows imported before the ids were stored are matched by tla
+        and name, and adopt the id. Returns the rows inserted, updated and deleted
+        by model. It is expected to run inside a transaction.
+        """
+        competition = Competition.objects.get(code=raw_competition.get("code"))
+        fresh_competition = self.build_competition(raw_competition)
+        fields = ["name", "area_name", "external_id"]
+        if self.copy_changes(fresh_competition, competition, fields):
+            competition.save(update_fields=fields)
+
+        with measure(self.metrics, "persist.teams"):
+            teams, team_changes = self.sync_teams(raw_teams, competition)
+        with measure(self.metrics, "persist.players"):
+            player_changes = self.sync_players(teams, raw_players)
+        player_changes["deleted"] += team_changes.pop("players_deleted")
+
+        with measure(self.metrics, "persist.player_count"):
+            # Teams are shared, their squads count for every league they play
+            competitions = Competition.objects.filter(
+                pk__in=Team.competitions.through.objects.filter(team__in=teams).values(
+                    "competition"
+                )
+            ) | Competition.objects.filter(pk=competition.pk)
+            refresh_player_counts(competitions)
+        with measure(self.metrics, "persist.summary"):
+            refresh_league_summaries(competitions)
+        return {"teams": team_changes, "players": player_changes}
+
+    def sync_teams(self, raw_teams, competition) -> Tuple[List[Team], dict]:
+        """
+        Teams that joined the league are inserted, or linked if another league
+        stored them already. Teams that left it are unlinked, and deleted once they
+        play no league.
+        """
+        stored = list(competition.team_set.all())
+        by_id = {t.external_id: t for t in stored if t.external_id is not None}
+        by_tla = {t.tla: t for t in stored if t.external_id is None}
+        fresh_teams = self.build_teams(raw_teams)
+        lock_teams(team.external_id for team in fresh_teams)
+        elsewhere = {
+            team.external_id: team
+            for team in Team.objects.filter(
+                external_id__in=[
+                    t.external_id for t in fresh_teams if t.external_id not in by_id
+                ]
+            )
+        }
+
+        fields = TEAM_SYNC_FIELDS + ["external_id"]
+        teams, new, linked, changed = [], [], [], []
+        for fresh in fresh_teams:
+            team = by_id.pop(fresh.external_id, None)
+            if team is None and fresh.external_id in elsewhere:
+                team = elsewhere[fresh.external_id]
+                linked.append(team)
+            if team is None:
+                team = by_tla.pop(fresh.tla, None)
+            if team is None:
+                new.append(fresh)
+                team = fresh
+            elif self.copy_changes(fresh, team, fields):
+                changed.append(team)
+            teams.append(team)
+
+        gone = [*by_id.values(), *by_tla.values()]
+        competition.team_set.remove(*gone)
+        _, deleted = Team.objects.filter(
+            pk__in=[team.pk for team in gone], competitions=None
+        ).delete()
+        Team.objects.bulk_update(changed, fields, batch_size=settings.IMPORT_BATCH_SIZE)
+        Team.objects.bulk_create(new, batch_size=settings.IMPORT_BATCH_SIZE)
+        competition.team_set.add(*new, *linked)
+        changes = {
+            "inserted": len(new),
+            "linked": len(linked),
+            "updated": len(changed),
+            "unlinked": len(gone),
+            "deleted": deleted.get(Team._meta.label, 0),
+            "players_deleted": deleted.get(Player._meta.label, 0),
+        }
+        return teams, changes
+
+    def sync_players(self, teams: List[Team], raw_players) -> dict:
+        # Players are matched across the whole league, a transfer between two of
+        # its teams only moves the player. Teams without a squad fetched are left
+        # as they are.
+        teams = [team for team in teams if team.tla in raw_players]
+        by_id, by_name = {}, {}
+        for player in Player.objects.filter(team__in=teams):
+            if player.external_id is not None:
+                by_id[player.external_id] = player
+            else:
+                by_name[(player.team_id, player.name)] = player
+
+        fields = PLAYER_SYNC_FIELDS + ["team_id", "external_id"]
+        new, changed = [], []
+        for team in teams:
+            for row in self.player_rows(raw_players[team.tla], team.pk):
+                fresh = Player(**dict(zip(PLAYER_FIELDS, row)))
+                player = by_id.pop(fresh.external_id, None) or by_name.pop(
+                    (team.pk, fresh.name), None
+                )
+                if player is None:
+                    new.append(row)
+                elif self.copy_changes(fresh, player, fields):
+                    changed.append(player)
+
+        gone = [player.pk for player in [*by_id.values(), *by_name.values()]]
+        deleted, _ = Player.objects.filter(pk__in=gone).delete()
+        Player.objects.bulk_update(
+            changed, fields, batch_size=settings.IMPORT_BATCH_SIZE
+        )
+        self.insert_players(new, len(new))
+        return {"inserted": len(new), "updated": len(changed), "deleted": deleted}
+
+    def copy_changes(self, source, target, fields) -> bool:
+        """
+        Copies the fields that differ from source to target, returns whether any did
+        """
+        changed = False
+        for field in fields:
+            value = getattr(source, field)
+            if getattr(target, field) != value:
+                setattr(target, field, value)
+                changed = True
+        return changed
+
+    def insert_players(self, rows: Iterable[tuple], count) -> None:
+        threshold = settings.IMPORT_COPY_THRESHOLD
+        if threshold and count >= threshold and connection.vendor == "postgresql":
+            copy_insert(Player, PLAYER_FIELDS, rows, self.metrics)
+        else:
+            for batch in chunked(rows, settings.IMPORT_BATCH_SIZE):
+                Player.objects.bulk_create(
+                    [Player(**dict(zip(PLAYER_FIELDS, row))) for row in batch]
+                )
+
+    def build_competition(self, raw_competition):
+        competition = Competition(
+            name=raw_competition.get("name"),
+            code=raw_competition.get("code"),
+            area_name=raw_competition.get("area").get("name"),
+            external_id=raw_competition.get("id"),
+        )
+        return competition
+
+    def build_teams(self, raw_teams: List[dict]):
+        teams = [
+            Team(
+                name=rt.get("name"),
+                tla=rt.get("tla"),
+                short_name=rt.get("shortName"),
+                area_name=rt.get("area").get("name"),
+                email=rt.get("email"),
+                external_id=rt.get("id"),
+            )
+            for rt in raw_teams
+        ]
+        return teams
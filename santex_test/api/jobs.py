@@ -0,0 +1,306 @@
+import logging
+import time
+import uuid
+
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from api.checkpoints import clear_checkpoints
+from api.football_data import AsyncFootballData, FootballData, PlayerRecord
+from api.importer import LeagueImporter
+from api.metrics import ImportMetrics, measure, record_job
+from api.models import Competition, ImportJob
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeagueAlreadyImported(Exception):
+    pass
+
+
+def enqueue_import(
+    league_code, api_key, batch=None, mode=ImportJob.IMPORT
+) -> Tuple[ImportJob, bool]:
+    """
+    Queues the import of the league unless one is already queued or running, in
+    which case the caller gets that job instead, its result is the league's.
+    Returns the job and whether it was created. A job running for longer than
+    IMPORT_JOB_STALE_AFTER seconds is taken for abandoned by a dead worker, it is
+    failed and a new one is queued.
+
+    At most one active job per league is enforced by a partial unique index, a
+    caller losing the race to create it gets the job of the winner.
+    """
+    while True:
+        job = (
+            ImportJob.objects.filter(
+                league_code=league_code, state__in=ImportJob.ACTIVE
+            )
+            .order_by("created_at")
+            .first()
+        )
+        if job is not None and not abandon_if_stale(job):
+            return job, False
+        if job is None:
+            try:
+                with transaction.atomic():
+                    job = ImportJob.objects.create(
+                        league_code=league_code, api_key=api_key, batch=batch, mode=mode
+                    )
+                return job, True
+            except IntegrityError:
+                # Queued meanwhile by a concurrent caller, attach to it
+                pass
+
+
+def abandon_if_stale(job: ImportJob) -> bool:
+    """
+    Fails the job if it has been running for longer than IMPORT_JOB_STALE_AFTER
+    seconds, returns whether it did
+    """
+    if job.state != ImportJob.RUNNING or job.started_at is None:
+        return False
+    stale_before = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+    if job.started_at >= stale_before:
+        return False
+    # Only one of the callers finding it stale fails it, the others find it gone
+    ImportJob.objects.filter(
+        pk=job.pk, state=ImportJob.RUNNING, started_at__lt=stale_before
+    ).update(
+        state=ImportJob.FAILED,
+        error="Abandoned: running for too long",
+        finished_at=timezone.now(),
+        api_key="",
+    )
+    return True
+
+
+def enqueue_imports(league_codes, api_key) -> Tuple[uuid.UUID, List[ImportJob]]:
+    """
+    Queues the leagues as a single batch, the worker imports them together.
+    Leagues with an import already queued or running share it instead, it goes
+    on in its own batch. The batch is committed at once, a worker never claims
+    part of it.
+    """
+    batch = uuid.uuid4()
+    # enqueue_import creates each job in a savepoint, a league queued meanwhile
+    # by another caller only rolls back its own job
+    with transaction.atomic():
+        jobs = [enqueue_import(code, api_key, batch=batch)[0] for code in league_codes]
+    return batch, jobs
+
+
+def start_refresh(league_code, api_key) -> Optional[ImportJob]:
+    """
+    Starts a sync of the league to be run by the calling process, the refresh
+    scheduler, instead of the import worker. Returns None when the league has an
+    import queued or running already.
+    """
+    active = ImportJob.objects.filter(
+        league_code=league_code, state__in=ImportJob.ACTIVE
+    ).first()
+    if active is not None and not abandon_if_stale(active):
+        return None
+    try:
+        with transaction.atomic():
+            return ImportJob.objects.create(
+                league_code=league_code,
+                api_key=api_key,
+                mode=ImportJob.SYNC,
+                state=ImportJob.RUNNING,
+                started_at=timezone.now(),
+            )
+    except IntegrityError:
+        return None
+
+
+def claim_next_jobs() -> List[ImportJob]:
+    """
+    Takes the oldest queued job, along with the rest of its batch, and marks them
+    as running. Jobs locked by other workers are skipped, so many workers can poll
+    the same table.
+    """
+    with transaction.atomic():
+        queued = ImportJob.objects.select_for_update(skip_locked=True).filter(
+            state=ImportJob.QUEUED
+        )
+        job = queued.order_by("created_at").first()
+        if job is None:
+            return []
+        jobs = [job]
+        if job.batch is not None:
+            jobs = list(queued.filter(batch=job.batch).order_by("created_at"))
+
+        started_at = timezone.now()
+        for job in jobs:
+            job.state = ImportJob.RUNNING
+            job.started_at = started_at
+        ImportJob.objects.bulk_update(jobs, ["state", "started_at"])
+    return jobs
+
+
+@contextmanager
+def stage(job: ImportJob, name, metrics: ImportMetrics = None):
+    """
+    Records the stage the job is going through and how long it took, and measures
+    it with metrics when given
+    """
+    job.stage = name
+    job.save(update_fields=["stage"])
+    started = time.perf_counter()
+    try:
+        with measure(metrics, name):
+            yield
+    finally:
+        job.timings[name] = round(time.perf_counter() - started, 3)
+        job.save(update_fields=["timings"])
+
+
+def run_jobs(
+    jobs: List[ImportJob], stage=stage, requests_per_minute=None, api_keys=None
+) -> List[ImportJob]:
+    """
+    Imports the leagues of the jobs one after the other, sync jobs of leagues
+    already imported update them instead. Jobs claimed together
+    share the api key, and with it the rate limit, and the squads of the teams
+    playing in more than one of their leagues are fetched once. Every league is
+    written in its own transaction so a failure only fails its job. The benchmarks
+    wrap stage to measure each one, the refresh scheduler paces the requests to
+    requests_per_minute instead of FOOTBALL_DATA_REQUESTS_PER_MINUTE.
+
+    The requests are spread over api_keys, by default the key of the jobs and,
+    once the server accepted that key, the pool of FOOTBALL_DATA_API_KEYS, so the
+    squads of a league are fetched as fast as all of them allow.
+    """
+    # A sync is pointless with the squads cached by the import it follows
+    revalidate = any(job.mode == ImportJob.SYNC for job in jobs)
+    metrics = ImportMetrics()
+    client = AsyncFootballData if settings.FOOTBALL_DATA_ASYNC else FootballData
+    pool_keys = []
+    if api_keys is None:
+        # The pool is lent to callers whose token the server takes, not to anyone
+        api_keys = [jobs[0].api_key]
+        pool_keys = settings.FOOTBALL_DATA_API_KEYS
+    football_data = client(
+        api_keys,
+        pool_keys=pool_keys,
+        requests_per_minute=requests_per_minute,
+        revalidate=revalidate,
+        metrics=metrics,
+    )
+    importer = LeagueImporter(football_data, metrics=metrics)
+    if settings.FOOTBALL_DATA_ASYNC:
+        # Database work in it comes back to this thread, and its connection
+        extract_data = async_to_sync(importer.extract_data_async)
+    else:
+        extract_data = importer.extract_data
+    known_squads: Dict[int, List[PlayerRecord]] = {}
+    for job in jobs:
+        metrics.reset()
+        try:
+            sync = importer.the_league_exists(job.league_code)
+            if sync and job.mode != ImportJob.SYNC:
+                raise LeagueAlreadyImported(job.league_code)
+
+            with stage(job, "extract", metrics):
+                raw_competition, raw_teams, raw_players = extract_data(
+                    job.league_code,
+                    known_squads,
+                    skip_stored_teams=not sync,
+                    # A sync is meant to bring fresh data, it only resumes a
+                    # sync that failed moments ago
+                    checkpoint_max_age=settings.SYNC_CHECKPOINT_MAX_AGE
+                    if sync
+                    else None,
+                )
+
+            with stage(job, "persist", metrics):
+                with transaction.atomic():
+                    if sync:
+                        job.changes = importer.sync_data(
+                            raw_competition, raw_teams, raw_players
+                        )
+                    else:
+                        importer.persist_data(raw_competition, raw_teams, raw_players)
+                    # Stored, the next import of the league fetches it afresh
+                    clear_checkpoints(job.league_code)
+                    Competition.objects.filter(code=job.league_code).update(
+                        refreshed_at=timezone.now()
+                    )
+
+            job.state = ImportJob.SUCCEEDED
+        except Exception as ex:
+            job.state = ImportJob.FAILED
+            job.error = f"{ex.__class__.__name__}: {ex}"
+
+        job.finished_at = timezone.now()
+        job.metrics = metrics.as_dict()
+        # The token of the caller is only kept while the job needs it
+        job.api_key = ""
+        job.save(
+            update_fields=[
+                "state",
+                "error",
+                "changes",
+                "metrics",
+                "finished_at",
+                "api_key",
+            ]
+        )
+        record_job(job)
+        log_job(job)
+    return jobs
+
+
+def log_job(job: ImportJob) -> None:
+    """
+    Logs a finished job as a single structured line, with everything it spent
+    """
+    logger.log(
+        logging.INFO if job.state == ImportJob.SUCCEEDED else logging.ERROR,
+        "Import %s",
+        job.state,
+        extra={
+            "job_id": job.id,
+            "league_code": job.league_code,
+            "batch": str(job.batch) if job.batch else None,
+            "mode": job.mode,
+            "state": job.state,
+            "error": job.error,
+            "seconds": (job.finished_at - job.started_at).total_seconds()
+            if job.started_at
+            else None,
+            "timings": job.timings,
+            "changes": job.changes,
+            "metrics": job.metrics,
+        },
+    )
+
+
+def run_next_jobs() -> List[ImportJob]:
+    jobs = claim_next_jobs()
+    if jobs:
+        run_jobs(jobs)
+    return jobs
+
+
+def run_worker(poll_interval=1.0, once=False) -> None:
+    """
+    Runs queued jobs one after the other. When the queue is empty it either waits
+    poll_interval seconds for new jobs or, if once is set, returns.
+    """
+    while True:
+        # Like a request would, drop the connections that went stale while waiting
+        close_old_connections()
+        jobs = run_next_jobs()
+        if not jobs:
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,159 @@
+import time
+import tracemalloc
+import uuid
+
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from api.fake_football_data import FakeFootballData
+from api.jobs import run_jobs, stage
+from api.models import ImportJob
+from api.views import LeagueImportView
+
+
+class Rollback(Exception):
+    pass
+
+
+class StageProbe:
+    """
+    Measures the wall time, api calls, rate limited calls, queries and peak memory
+    of each stage of an import
+    """
+
+    def __init__(self, fake: FakeFootballData) -> None:
+        self.fake = fake
+        self.results = []
+
+    @contextmanager
+    def measure(self, name):
+        stats = self.fake.stats.copy()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            yield
+        self.results.append(
+            {
+                "stage": name,
+                "seconds": time.perf_counter() - started,
+                "api calls": self.fake.stats["requests"] - stats["requests"],
+                "429s": self.fake.stats["rate_limited"] - stats["rate_limited"],
+                "queries": len(queries),
+                "peak MB": tracemalloc.get_traced_memory()[1] / 2**20,
+            }
+        )
+
+    @contextmanager
+    def stage(self, job, name, metrics=None):
+        with self.measure(name), stage(job, name, metrics):
+            yield
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports synthetic leagues served by a local stand-in of football-data.org "
+        "and reports the wall time, api calls, queries and peak memory of every "
+        "stage. The imported leagues are rolled back once measured."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--teams", type=int, nargs="+", default=[20, 100, 500], help="Per league"
+        )
+        parser.add_argument("--players", type=int, default=25, help="Per team")
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds per api response"
+        )
+        parser.add_argument(
+            "--requests-per-minute",
+            type=int,
+            default=600,
+            help="Rate limit the import paces itself to",
+        )
+        parser.add_argument(
+            "--keys",
+            type=int,
+            default=1,
+            help="Api keys the import spreads its requests over, each allowed "
+            "--requests-per-minute",
+        )
+        parser.add_argument(
+            "--server-limit",
+            type=int,
+            default=None,
+            help="Requests the stand-in serves per window before answering 429",
+        )
+        parser.add_argument(
+            "--window", type=float, default=60.0, help="Seconds of the server window"
+        )
+
+    def handle(self, *args, **options):
+        leagues = {f"SYN{teams}": teams for teams in options["teams"]}
+        fake = FakeFootballData(
+            leagues,
+            players_per_team=options["players"],
+            latency=options["latency"],
+            requests_per_window=options["server_limit"],
+            window=options["window"],
+        )
+        rpm = options["requests_per_minute"]
+        tracemalloc.start()
+        try:
+            with fake, override_settings(
+                FOOTBALL_DATA_URL=fake.url,
+                FOOTBALL_DATA_REQUESTS_PER_MINUTE=rpm,
+                FOOTBALL_DATA_POOL_SIZE=rpm,
+                FOOTBALL_DATA_CACHE_DIR="",
+            ):
+                for code in leagues:
+                    self.report(code, self.bench(fake, code, options["keys"]))
+        finally:
+            tracemalloc.stop()
+
+    def bench(self, fake, code, keys):
+        probe = StageProbe(fake)
+        # Every league gets its own tokens, and rate limiters of its own
+        api_key, *pool = [f"bench-{uuid.uuid4().hex[:8]}" for _ in range(keys)]
+        request = APIRequestFactory().get(
+            f"/api/import-league/{code}", {"X-Auth-Token": api_key}
+        )
+        try:
+            with transaction.atomic():
+                with probe.measure("request"):
+                    response = LeagueImportView.as_view()(request, league_code=code)
+                if response.status_code != 202:
+                    raise CommandError(f"{code}: {response.data}")
+
+                job = ImportJob.objects.get(pk=response.data["job_id"])
+                job.state = ImportJob.RUNNING
+                job.started_at = timezone.now()
+                run_jobs([job], stage=probe.stage, api_keys=[api_key] + pool)
+                if job.state != ImportJob.SUCCEEDED:
+                    raise CommandError(f"{code}: {job.error}")
+                raise Rollback()
+        except Rollback:
+            pass
+        return probe.results
+
+    def report(self, code, results):
+        self.stdout.write(f"{code}")
+        self.stdout.write(
+            f"{'stage':>10} {'seconds':>9} {'api calls':>9} {'429s':>6} "
+            f"{'queries':>8} {'peak MB':>8}"
+        )
+        for row in results:
+            self.stdout.write(
+                f"{row['stage']:>10} {row['seconds']:>9.3f} {row['api calls']:>9} "
+                f"{row['429s']:>6} {row['queries']:>8} {row['peak MB']:>8.1f}"
+            )
+        self.stdout.write(
+            f"{'total':>10} {sum(row['seconds'] for row in results):>9.3f} "
+            f"{sum(row['api calls'] for row in results):>9} "
+            f"{sum(row['429s'] for row in results):>6} "
+            f"{sum(row['queries'] for row in results):>8}"
+        )
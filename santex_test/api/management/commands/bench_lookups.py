@@ -0,0 +1,92 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import Competition, Team
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of the league lookups with many competitions stored. "
+        "The synthetic competitions are rolled back once measured."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--competitions", type=int, default=1000)
+        parser.add_argument("--teams", type=int, default=20, help="Per competition")
+        parser.add_argument("--repeat", type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.load(options["competitions"], options["teams"])
+                self.measure(options["competitions"], options["repeat"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def load(self, competitions, teams):
+        started = time.perf_counter()
+        stored = Competition.objects.bulk_create(
+            Competition(name=f"Bench {n}", code=f"BENCH{n}", area_name="Bench")
+            for n in range(competitions)
+        )
+        created = Team.objects.bulk_create(
+            Team(
+                name=f"Team {n}",
+                tla=f"T{n}",
+                short_name=f"Team {n}",
+                area_name="Bench",
+            )
+            for _ in stored
+            for n in range(teams)
+        )
+        Through = Team.competitions.through
+        Through.objects.bulk_create(
+            Through(team=team, competition=stored[n // teams])
+            for n, team in enumerate(created)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE api_competition, api_team, api_team_competitions")
+        self.stdout.write(
+            f"Loaded {competitions} competitions with {teams} teams each in "
+            f"{time.perf_counter() - started:.2f}s"
+        )
+
+    def measure(self, competitions, repeat):
+        competition = Competition.objects.get(code=f"BENCH{competitions // 2}")
+        lookups = {
+            "league exists": lambda: Competition.objects.filter(
+                code=competition.code
+            ).exists(),
+            "player count": lambda: Competition.objects.filter(code=competition.code)
+            .values_list("player_count", flat=True)
+            .first(),
+            "team by tla": lambda: Team.objects.filter(
+                competitions=competition, tla="T1"
+            ).first(),
+        }
+        for name, lookup in lookups.items():
+            latencies = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                lookup()
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            self.stdout.write(
+                f"{name:>14}: mean {statistics.mean(latencies):.3f}ms "
+                f"p95 {latencies[int(len(latencies) * 0.95)]:.3f}ms"
+            )
+
+        queries = {
+            "league exists": Competition.objects.filter(code=competition.code),
+            "team by tla": Team.objects.filter(competitions=competition, tla="T1"),
+        }
+        for name, queryset in queries.items():
+            self.stdout.write(f"{name} plan:\n{queryset.explain()}")
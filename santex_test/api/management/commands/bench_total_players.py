@@ -0,0 +1,90 @@
+import threading
+import time
+
+from collections import Counter
+
+import requests
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the player count endpoint of a running server and reports the "
+        "throughput and latency at every concurrency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", default="http://localhost:8000/api/total-players/ELC"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            nargs="+",
+            default=[1, 8, 32, 64],
+            help="Clients requesting at once, one run each",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=10.0, help="Seconds of every run"
+        )
+        parser.add_argument(
+            "--revalidate",
+            action="store_true",
+            help="Send the ETag of the first response, as a caching client would",
+        )
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options["revalidate"]:
+            etag = requests.get(options["url"]).headers.get("ETag")
+            if etag:
+                headers["If-None-Match"] = etag
+
+        self.stdout.write(
+            f"{'clients':>8} {'requests':>9} {'req/s':>9} {'p50 ms':>8} "
+            f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+        )
+        for clients in options["concurrency"]:
+            latencies, statuses = self.run(
+                options["url"], headers, clients, options["duration"]
+            )
+            latencies.sort()
+            errors = sum(n for code, n in statuses.items() if code not in (200, 304))
+
+            def percentile(p):
+                return latencies[int(len(latencies) * p)] * 1000 if latencies else 0
+
+            self.stdout.write(
+                f"{clients:>8} {len(latencies):>9} "
+                f"{len(latencies) / options['duration']:>9.1f} "
+                f"{percentile(0.5):>8.2f} {percentile(0.95):>8.2f} "
+                f"{percentile(0.99):>8.2f} {errors:>7}"
+            )
+
+    def run(self, url, headers, clients, duration):
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def client():
+            # A keep-alive connection per client, as a browser or proxy would hold
+            session = requests.Session()
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    code = session.get(url, headers=headers, timeout=10).status_code
+                except requests.RequestException:
+                    code = None
+                latency = time.perf_counter() - started
+                with lock:
+                    latencies.append(latency)
+                    statuses[code] += 1
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, statuses
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import EXPORTS, export_csv
+from api.models import Competition
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the players, or the teams, of an imported league as CSV, reading "
+        "them a chunk at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("league_code")
+        parser.add_argument("--table", choices=list(EXPORTS), default="players")
+        parser.add_argument(
+            "--output", help="File to write, the standard output by default"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Rows read at a time, EXPORT_CHUNK_SIZE by default",
+        )
+
+    def handle(self, *args, **options):
+        code = options["league_code"]
+        if not Competition.objects.filter(code=code).exists():
+            raise CommandError(f"League {code} is not imported")
+
+        chunks = export_csv(code, options["table"], options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
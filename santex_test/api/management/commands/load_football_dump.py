@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.dump import DumpLoader, FootballDump
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads the leagues of a directory of football-data.org responses, "
+        "competitions/<code>.json, competitions/<id>/teams.json and teams/<id>.json, "
+        "copying the players from worker processes. Leagues already imported are "
+        "skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes copying the players, one per cpu by default",
+        )
+        parser.add_argument(
+            "--defer-indexes",
+            action="store_true",
+            help=(
+                "Drops the indexes of the players table while loading and builds "
+                "them again after, for big dumps loaded into a database not "
+                "serving reads yet"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        dump = FootballDump(options["directory"])
+        if not dump.competition_codes():
+            raise CommandError(f"No competitions in {options['directory']}")
+
+        started_at = time.perf_counter()
+        loaded = DumpLoader(
+            dump,
+            workers=options["workers"],
+            defer_indexes=options["defer_indexes"],
+        ).load()
+        seconds = time.perf_counter() - started_at
+
+        if loaded["skipped"]:
+            self.stdout.write(f"Already imported: {', '.join(loaded['skipped'])}")
+        self.stdout.write(
+            f"Loaded {len(loaded['leagues'])} leagues, {loaded['teams']} teams and "
+            f"{loaded['players']} players in {seconds:.1f}s"
+        )
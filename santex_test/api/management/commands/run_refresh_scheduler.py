@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.refresh import run_scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs the imported leagues every REFRESH_INTERVAL seconds, the most read "
+        "first, pacing the requests to REFRESH_REQUESTS_PER_MINUTE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--api-key",
+            default=settings.FOOTBALL_DATA_REFRESH_API_KEY,
+            help="football-data.org token of the refreshes, "
+            "FOOTBALL_DATA_REFRESH_API_KEY by default",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=60.0,
+            help="Seconds to wait before looking again when no league is due",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no league is due instead of waiting",
+        )
+
+    def handle(self, *args, **options):
+        if not options["api_key"]:
+            raise CommandError("Missing --api-key or FOOTBALL_DATA_REFRESH_API_KEY")
+        run_scheduler(
+            options["api_key"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
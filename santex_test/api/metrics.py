@@ -0,0 +1,256 @@
+import threading
+import time
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, List
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+
+from api.models import ImportJob, ImportMetric
+
+
+class ImportMetrics:
+    """
+    Collects what an import spends in each of its stages: seconds, database
+    queries and the seconds they took, football-data.org requests with their
+    seconds and bytes, retries after a 429, seconds waited for the rate limit and
+    payloads resumed from checkpoints.
+
+    Stages can be nested, everything done inside a stage counts for it and for the
+    stages around it. Squads are fetched from many threads, their requests count
+    for the stages the import is going through meanwhile.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages: Dict[str, Counter] = defaultdict(Counter)
+        self.requests: Dict[str, Counter] = defaultdict(Counter)
+        self._active: List[str] = []
+
+    @contextmanager
+    def measure(self, name):
+        with self._lock:
+            self._active.append(name)
+        started = time.perf_counter()
+        try:
+            with self.counting_queries():
+                yield
+        finally:
+            with self._lock:
+                self._active.remove(name)
+                self.stages[name]["seconds"] += time.perf_counter() - started
+
+    def counting_queries(self):
+        """
+        Counts the queries of this thread for the stages going on. Execute wrappers
+        are per thread, database work handed to another thread, as
+        database_sync_to_async does, counts with counting.
+        """
+        if self.count_query in connection.execute_wrappers:
+            return nullcontext()
+        return connection.execute_wrapper(self.count_query)
+
+    def count_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(time.perf_counter() - started)
+
+    def record_query(self, seconds) -> None:
+        """
+        Counts a query for the stages going on, for the ones made around the
+        execute wrappers, like COPY
+        """
+        with self._lock:
+            for name in self._active:
+                self.stages[name]["queries"] += 1
+                self.stages[name]["query_seconds"] += seconds
+
+    def record_request(self, endpoint, status_code, seconds, size) -> None:
+        with self._lock:
+            request = self.requests[endpoint]
+            request["calls"] += 1
+            request["seconds"] += seconds
+            request["bytes"] += size
+            if status_code == 429:
+                request["rate_limited"] += 1
+            for name in self._active:
+                self.stages[name]["api_calls"] += 1
+                self.stages[name]["api_seconds"] += seconds
+                self.stages[name]["bytes"] += size
+
+    def record_cache_hit(self, endpoint) -> None:
+        with self._lock:
+            self.requests[endpoint]["cache_hits"] += 1
+
+    def record_retry(self) -> None:
+        self._count_in_stages("retries", 1)
+
+    def record_resumed(self, payloads) -> None:
+        self._count_in_stages("resumed", payloads)
+
+    def record_wait(self, seconds) -> None:
+        if seconds:
+            self._count_in_stages("rate_limit_wait", seconds)
+
+    def _count_in_stages(self, key, value) -> None:
+        with self._lock:
+            for name in self._active:
+                self.stages[name][key] += value
+
+    def as_dict(self) -> dict:
+        def rounded(counters):
+            return {
+                name: {key: round(value, 4) for key, value in counter.items()}
+                for name, counter in counters.items()
+            }
+
+        with self._lock:
+            return {
+                "stages": rounded(self.stages),
+                "requests": rounded(self.requests),
+            }
+
+
+def measure(metrics, name):
+    """
+    Measures the block with metrics when there are, for the code that may run
+    without them
+    """
+    return metrics.measure(name) if metrics is not None else nullcontext()
+
+
+def counting(metrics, func):
+    """
+    Wraps func to count its queries for the stages of metrics going on, in the
+    thread it runs in
+    """
+    if metrics is None:
+        return func
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        with metrics.counting_queries():
+            return func(*args, **kwargs)
+
+    return inner
+
+
+# Running totals exposed by the metrics endpoint, name: (help, key in the stage or
+# request counters of ImportMetrics)
+STAGE_METRICS = {
+    "import_stage_seconds_total": ("Seconds spent in the import stage", "seconds"),
+    "import_stage_queries_total": ("Database queries run in the stage", "queries"),
+    "import_stage_query_seconds_total": (
+        "Seconds spent running database queries in the stage",
+        "query_seconds",
+    ),
+    "import_stage_api_requests_total": (
+        "Requests made to football-data.org in the stage",
+        "api_calls",
+    ),
+    "import_stage_api_seconds_total": (
+        "Seconds spent on requests to football-data.org in the stage",
+        "api_seconds",
+    ),
+    "import_stage_api_bytes_total": (
+        "Bytes received from football-data.org in the stage",
+        "bytes",
+    ),
+    "import_stage_api_retries_total": (
+        "Requests retried after being rate limited in the stage",
+        "retries",
+    ),
+    "import_stage_resumed_total": (
+        "Payloads resumed from the checkpoints of a failed import in the stage",
+        "resumed",
+    ),
+    "import_stage_rate_limit_wait_seconds_total": (
+        "Seconds spent waiting for the rate limit in the stage",
+        "rate_limit_wait",
+    ),
+}
+REQUEST_METRICS = {
+    "football_data_requests_total": ("Requests made by endpoint", "calls"),
+    "football_data_request_seconds_total": (
+        "Seconds spent on the requests by endpoint",
+        "seconds",
+    ),
+    "football_data_response_bytes_total": ("Bytes received by endpoint", "bytes"),
+    "football_data_rate_limited_total": (
+        "Requests answered with 429 by endpoint",
+        "rate_limited",
+    ),
+    "football_data_cache_hits_total": (
+        "Responses served from the local cache by endpoint",
+        "cache_hits",
+    ),
+}
+JOBS_METRIC = ("import_jobs_finished_total", "Import jobs finished by mode and state")
+JOBS_GAUGE = ("import_jobs", "Import jobs by state")
+
+
+def render_labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def record_job(job: ImportJob) -> None:
+    """
+    Adds what a finished job spent to the running totals
+    """
+    increments = {(JOBS_METRIC[0], render_labels(mode=job.mode, state=job.state)): 1}
+    for stage, counters in job.metrics.get("stages", {}).items():
+        labels = render_labels(stage=stage)
+        for name, (_, key) in STAGE_METRICS.items():
+            if counters.get(key):
+                increments[(name, labels)] = counters[key]
+    for endpoint, counters in job.metrics.get("requests", {}).items():
+        labels = render_labels(endpoint=endpoint)
+        for name, (_, key) in REQUEST_METRICS.items():
+            if counters.get(key):
+                increments[(name, labels)] = counters[key]
+
+    with transaction.atomic():
+        for (name, labels), value in increments.items():
+            metric, _ = ImportMetric.objects.get_or_create(name=name, labels=labels)
+            ImportMetric.objects.filter(pk=metric.pk).update(value=F("value") + value)
+
+
+def render_metrics() -> str:
+    """
+    Renders the running totals, and the jobs by state, in the Prometheus text
+    exposition format
+    """
+    totals = defaultdict(list)
+    for metric in ImportMetric.objects.order_by("name", "labels"):
+        totals[metric.name].append(metric)
+
+    lines = []
+    counters = {JOBS_METRIC[0]: JOBS_METRIC[1]}
+    counters.update({name: help for name, (help, _) in STAGE_METRICS.items()})
+    counters.update({name: help for name, (help, _) in REQUEST_METRICS.items()})
+    for name, help in counters.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+        for metric in totals[name]:
+            lines.append(f"{name}{{{metric.labels}}} {metric.value!r}")
+
+    name, help = JOBS_GAUGE
+    jobs = dict(
+        ImportJob.objects.values_list("state").annotate(count=Count("id")).order_by()
+    )
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} gauge")
+    for state, _ in ImportJob.STATES:
+        lines.append(f"{name}{{{render_labels(state=state)}}} {jobs.get(state, 0)}")
+    return "\n".join(lines) + "\n"
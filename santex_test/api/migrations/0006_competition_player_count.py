@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_players(apps, schema_editor):
+    Competition = apps.get_model("api", "Competition")
+    competitions = Competition.objects.annotate(players=Count("team__player"))
+    for competition in competitions:
+        competition.player_count = competition.players
+        competition.save(update_fields=["player_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_importjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="competition",
+            name="player_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+    ]
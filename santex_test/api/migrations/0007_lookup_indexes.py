@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+def remove_duplicated_competitions(apps, schema_editor):
+    """
+    Concurrent imports of a league could store it twice, the newer copies go away
+    so the code can be unique
+    """
+    Competition = apps.get_model("api", "Competition")
+    seen = set()
+    for competition in Competition.objects.exclude(code=None).order_by("id"):
+        if competition.code in seen:
+            competition.delete()
+        seen.add(competition.code)
+    # The foreign keys of the deleted rows wait for the commit, and PostgreSQL
+    # alters no table with checks pending
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_competition_player_count"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicated_competitions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="competition",
+            name="code",
+            field=models.CharField(max_length=32, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="team",
+            index=models.Index(
+                fields=["competition", "tla"], name="api_team_competi_bdf8b4_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="batch",
+            field=models.UUIDField(db_index=True, null=True),
+        ),
+    ]
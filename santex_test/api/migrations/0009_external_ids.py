@@ -0,0 +1,49 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_importjob_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="changes",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="mode",
+            field=models.CharField(
+                choices=[("import", "Import"), ("sync", "Sync")],
+                default="import",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="external_id",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="team",
+            name="external_id",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="player",
+            constraint=models.UniqueConstraint(
+                fields=("team", "external_id"), name="unique_player_external_id"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="team",
+            constraint=models.UniqueConstraint(
+                fields=("competition", "external_id"), name="unique_team_external_id"
+            ),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+def share_teams(apps, schema_editor):
+    """
+    Links every team to its competition and merges the copies of a club imported
+    for more than one competition into the oldest one, whose players are kept.
+    Teams imported before football-data.org ids were stored can not be told apart
+    from a namesake, they are left as they are.
+    """
+    Team = apps.get_model("api", "Team")
+    Through = Team.competitions.through
+
+    Through.objects.bulk_create(
+        Through(team_id=team_id, competition_id=competition_id)
+        for team_id, competition_id in Team.objects.values_list("id", "competition_id")
+    )
+
+    kept = {}
+    for team in Team.objects.exclude(external_id=None).order_by("id"):
+        if team.external_id not in kept:
+            kept[team.external_id] = team
+            continue
+        kept[team.external_id].competitions.add(team.competition_id)
+        # Its players are copies of the ones of the kept team
+        team.delete()
+    # The foreign keys of the deleted rows wait for the commit, and PostgreSQL
+    # alters no table with checks pending
+    schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+
+def unshare_teams(apps, schema_editor):
+    Team = apps.get_model("api", "Team")
+    for team in Team.objects.all():
+        team.competition = team.competitions.order_by("id").first()
+        team.save(update_fields=["competition"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_external_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="competition",
+            name="external_id",
+            field=models.IntegerField(null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="team",
+            name="competitions",
+            field=models.ManyToManyField(to="api.Competition"),
+        ),
+        migrations.AlterField(
+            model_name="team",
+            name="competition",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=models.deletion.CASCADE,
+                to="api.competition",
+            ),
+        ),
+        migrations.RunPython(share_teams, unshare_teams),
+        migrations.RemoveConstraint(
+            model_name="team",
+            name="unique_team_external_id",
+        ),
+        migrations.RemoveIndex(
+            model_name="team",
+            name="api_team_competi_bdf8b4_idx",
+        ),
+        migrations.RemoveField(
+            model_name="team",
+            name="competition",
+        ),
+        migrations.AlterField(
+            model_name="team",
+            name="external_id",
+            field=models.IntegerField(null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_shared_teams"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportMetric",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=128)),
+                ("labels", models.CharField(default="", max_length=256)),
+                ("value", models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="metrics",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddConstraint(
+            model_name="importmetric",
+            constraint=models.UniqueConstraint(
+                fields=("name", "labels"), name="unique_import_metric"
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_imports(apps, schema_editor):
+    # Of the jobs queued or running for a league only the oldest goes on
+    ImportJob = apps.get_model("api", "ImportJob")
+    active = ImportJob.objects.filter(state__in=["queued", "running"])
+    seen = set()
+    duplicates = []
+    for job_id, league_code in active.order_by("created_at").values_list(
+        "id", "league_code"
+    ):
+        if league_code in seen:
+            duplicates.append(job_id)
+        seen.add(league_code)
+    ImportJob.objects.filter(pk__in=duplicates).update(
+        state="failed", error="Duplicate: another import of the league was active"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_import_metrics"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_imports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="importjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(state__in=["queued", "running"]),
+                fields=("league_code",),
+                name="single_active_import_per_league",
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_single_active_import"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                fields=["nationality", "id"], name="api_player_nationa_650114_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="player",
+            index=models.Index(
+                fields=["position", "id"], name="api_player_positio_f8e0da_idx"
+            ),
+        ),
+    ]
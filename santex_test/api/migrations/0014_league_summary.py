@@ -0,0 +1,42 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_player_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeagueSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("players", models.PositiveIntegerField(default=0)),
+                ("average_date_of_birth", models.DateTimeField(null=True)),
+                ("positions", models.JSONField(default=dict)),
+                ("nationalities", models.JSONField(default=dict)),
+                ("squads", models.JSONField(default=list)),
+                ("refreshed_at", models.DateTimeField(auto_now=True)),
+                (
+                    "competition",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="summary",
+                        to="api.competition",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_league_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("league_code", models.CharField(max_length=32)),
+                (
+                    "step",
+                    models.CharField(
+                        choices=[
+                            ("competition", "Competition"),
+                            ("teams", "Teams"),
+                            ("squad", "Squad"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("key", models.CharField(default="", max_length=32)),
+                ("payload", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="importcheckpoint",
+            constraint=models.UniqueConstraint(
+                fields=("league_code", "step", "key"), name="unique_import_checkpoint"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_import_checkpoints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="competition",
+            name="reads",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="competition",
+            name="refreshed_at",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
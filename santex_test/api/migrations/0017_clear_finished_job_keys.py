@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:02
+
+from django.db import migrations
+
+
+def clear_finished_job_keys(apps, schema_editor):
+    # Tokens of the callers were kept after their jobs were done
+    ImportJob = apps.get_model("api", "ImportJob")
+    ImportJob.objects.filter(state__in=["succeeded", "failed"]).exclude(
+        api_key=""
+    ).update(api_key="")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_competition_refresh"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_finished_job_keys, migrations.RunPython.noop),
+    ]
@@ -10,8 +10,16 @@ from django.db import models
 
 class Competition(models.Model):
     name = models.CharField(max_length=256)
-    code = models.CharField(max_length=32, null=True)
+    code = models.CharField(max_length=32, null=True, unique=True)
     area_name = models.CharField(max_length=256)
+    # football-data.org competition id
+    external_id = models.IntegerField(null=True, unique=True)
+    # Denormalized number of players of all the teams, maintained by the importer
+    player_count = models.PositiveIntegerField(default=0)
+    # Last import or sync of the league, and reads of it since the scheduled refresh
+    # brought it up to date, see api.refresh
+    refreshed_at = models.DateTimeField(null=True)
+    reads = models.PositiveIntegerField(default=0)
 
 
 class Team(models.Model):
@@ -20,7 +28,10 @@ class Team(models.Model):
     short_name = models.CharField(max_length=64)
     area_name = models.CharField(max_length=256)
     email = models.EmailField(null=True)
-    competition = models.ForeignKey(Competition, on_delete=models.CASCADE)
+    # A club playing many competitions is stored once, along with its players
+    competitions = models.ManyToManyField(Competition)
+    # football-data.org team id, missing on teams imported before it was stored
+    external_id = models.IntegerField(null=True, unique=True)
 
 
 class Player(models.Model):
@@ -30,3 +41,132 @@ class Player(models.Model):
     country_of_birth = models.CharField(max_length=256)
     nationality = models.CharField(max_length=256)
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    # football-data.org player id, missing on players imported before it was stored
+    external_id = models.IntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["team", "external_id"], name="unique_player_external_id"
+            )
+        ]
+        # Filtered pages of the players api are a range scan of one of these
+        indexes = [
+            models.Index(fields=["nationality", "id"]),
+            models.Index(fields=["position", "id"]),
+        ]
+
+
+class ImportJob(models.Model):
+    IMPORT = "import"
+    SYNC = "sync"
+    MODES = [(IMPORT, "Import"), (SYNC, "Sync")]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+    ACTIVE = [QUEUED, RUNNING]
+
+    league_code = models.CharField(max_length=32)
+    # The worker imports the league on behalf of the caller, with its token. It is
+    # cleared once the job succeeds or fails.
+    api_key = models.CharField(max_length=64)
+    # Jobs queued together are run together, see api.jobs.enqueue_imports
+    batch = models.UUIDField(null=True, db_index=True)
+    # Sync updates a league already imported instead of failing
+    mode = models.CharField(max_length=16, choices=MODES, default=IMPORT)
+    state = models.CharField(max_length=16, choices=STATES, default=QUEUED)
+    stage = models.CharField(max_length=32, null=True)
+    # Seconds spent on each stage, by stage name
+    timings = models.JSONField(default=dict)
+    error = models.TextField(null=True)
+    # Rows inserted, updated and deleted by model
+    changes = models.JSONField(default=dict)
+    # What each stage spent, see api.metrics.ImportMetrics
+    metrics = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "created_at"])]
+        constraints = [
+            # Concurrent requests for a league share a single import
+            models.UniqueConstraint(
+                fields=["league_code"],
+                condition=models.Q(state__in=["queued", "running"]),
+                name="single_active_import_per_league",
+            )
+        ]
+
+
+class ImportMetric(models.Model):
+    """
+    Running total of an import metric, shared by every worker process and exposed
+    by the metrics endpoint
+    """
+
+    name = models.CharField(max_length=128)
+    # Rendered Prometheus labels, e.g. stage="extract"
+    labels = models.CharField(max_length=256, default="")
+    value = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "labels"], name="unique_import_metric"
+            )
+        ]
+
+
+class LeagueSummary(models.Model):
+    """
+    Breakdowns of the players of a competition, refreshed by the importer in the
+    transaction writing them so the stats endpoint reads a single row
+    """
+
+    competition = models.OneToOneField(
+        Competition, on_delete=models.CASCADE, related_name="summary"
+    )
+    players = models.PositiveIntegerField(default=0)
+    # Mean of the dates of birth known, the age is worked out when read
+    average_date_of_birth = models.DateTimeField(null=True)
+    # Players by position and by nationality
+    positions = models.JSONField(default=dict)
+    nationalities = models.JSONField(default=dict)
+    # id, name, tla and players of every team
+    squads = models.JSONField(default=list)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+
+class ImportCheckpoint(models.Model):
+    """
+    A payload fetched by an import, kept until the league is persisted so a retry
+    of a failed import resumes instead of fetching everything again
+    """
+
+    COMPETITION = "competition"
+    TEAMS = "teams"
+    SQUAD = "squad"
+    STEPS = [(COMPETITION, "Competition"), (TEAMS, "Teams"), (SQUAD, "Squad")]
+
+    league_code = models.CharField(max_length=32)
+    step = models.CharField(max_length=16, choices=STEPS)
+    # football-data.org team id of a squad, empty for the other steps
+    key = models.CharField(max_length=32, default="")
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["league_code", "step", "key"], name="unique_import_checkpoint"
+            )
+        ]
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key. Every page is an index range scan from
+    the last id of the previous one, where an OFFSET would read and throw away all
+    the rows before it, and no COUNT of the table is run.
+    """
+
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = 500
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.models import Competition
+
+
+def cache_key(league_code) -> str:
+    return f"total-players:{league_code}"
+
+
+def get_total_players(league_code) -> Optional[int]:
+    """
+    Read-through cache of the denormalized player count of a league, None when the
+    league is not imported
+    """
+    total = cache.get(cache_key(league_code))
+    if total is None:
+        total = (
+            Competition.objects.filter(code=league_code)
+            .values_list("player_count", flat=True)
+            .first()
+        )
+        if total is not None:
+            cache.set(
+                cache_key(league_code), total, settings.TOTAL_PLAYERS_CACHE_TIMEOUT
+            )
+    return total
+
+
+def forget_total_players(league_code) -> None:
+    cache.delete(cache_key(league_code))
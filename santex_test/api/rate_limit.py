@@ -0,0 +1,255 @@
+import asyncio
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Paces the requests made with a single api key.
+
+    The bucket starts full and refills evenly along the period. football-data.org
+    tells on every response how many requests are left and in how many seconds the
+    counter resets, once we know that the bucket trusts the server instead of its
+    own refill rate. A bucket with a reserve leaves that many requests of the
+    counter of the server to whoever else uses the key, it waits for the reset
+    once the server counts no more than the reserve left.
+    """
+
+    AVAILABLE_HEADER = "X-Requests-Available-Minute"
+    RESET_HEADER = "X-RequestCounter-Reset"
+
+    def __init__(
+        self, capacity, period=60.0, clock=None, sleep=None, reserve=0
+    ) -> None:
+        self.capacity = capacity
+        self.reserve = reserve
+        self.period = period
+        self._clock = clock or time.monotonic
+        self._sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated_at = self._clock()
+        self._reset_at: Optional[float] = None
+        self._disabled_until: Optional[float] = None
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+    def acquire(self) -> float:
+        """
+        Takes a token, sleeping until there is one available. Returns the time
+        spent waiting for it.
+        """
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait is None:
+                return waited
+            self._sleep(wait)
+            waited += wait
+
+    async def acquire_async(self) -> float:
+        """
+        Like acquire, but waits without blocking the event loop
+        """
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait is None:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def disable(self, seconds) -> None:
+        """
+        Takes the api key out of rotation, for when the server refuses it
+        """
+        with self._lock:
+            self._disabled_until = self._clock() + seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self._disabled_until is None or self._clock() >= self._disabled_until
+
+    def _take(self) -> Optional[float]:
+        """
+        Takes a token if there is one, otherwise returns the time to wait for it
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return self._wait_time(now)
+
+    def update_from_headers(self, headers) -> None:
+        """
+        Syncs the bucket with the rate limit headers of a football-data.org response
+        """
+        available = headers.get(self.AVAILABLE_HEADER)
+        reset = headers.get(self.RESET_HEADER)
+        if available is None or reset is None:
+            return
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            # Requests still in flight are not counted by the server yet
+            self._tokens = min(self._tokens, max(float(available) - self.reserve, 0.0))
+            self._reset_at = now + float(reset)
+
+    def exhaust(self) -> None:
+        """
+        Empties the bucket after being rate limited. If the server did not say when
+        the counter resets we wait for a whole period.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = 0.0
+            if self._reset_at is None or self._reset_at <= now:
+                self._reset_at = now + self.period
+            self._updated_at = now
+
+    def _refill(self, now) -> None:
+        if self._reset_at is not None:
+            if now >= self._reset_at:
+                self._tokens = float(self.capacity)
+                self._reset_at = None
+        else:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def _wait_time(self, now) -> float:
+        if self._reset_at is not None:
+            return max(self._reset_at - now, 0.0)
+        return (1 - self._tokens) / self.rate
+
+
+_rate_limiters: Dict[str, TokenBucket] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key, requests_per_minute) -> TokenBucket:
+    """
+    Returns the bucket of the given api key, every FootballData instance using the
+    same key in this process shares it.
+    """
+    with _rate_limiters_lock:
+        if api_key not in _rate_limiters:
+            _rate_limiters[api_key] = TokenBucket(requests_per_minute)
+        return _rate_limiters[api_key]
+
+
+class NoKeysLeft(Exception):
+    pass
+
+
+class TokenPool:
+    """
+    Spreads the requests over many api keys, each paced by its own bucket. Keys
+    take turns, a request takes a token of the first one that has any. A key rate
+    limited by the server has its bucket emptied until the counter resets, so the
+    others are taken meanwhile, and a key refused by the server is disabled for a
+    while.
+
+    The pool_keys join the rotation only once the server has answered a request
+    made with the api_keys, so a token it refuses never gets the pool to spend.
+    """
+
+    def __init__(self, api_keys: List[str], requests_per_minute, pool_keys=()) -> None:
+        self.buckets = {
+            key: get_rate_limiter(key, requests_per_minute)
+            for key in dict.fromkeys(api_keys)
+        }
+        self.pool_buckets = {
+            key: get_rate_limiter(key, requests_per_minute)
+            for key in dict.fromkeys(pool_keys)
+            if key not in self.buckets
+        }
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    @property
+    def capacity(self) -> int:
+        """
+        Requests per minute of the keys in rotation, and of the pool keys waiting
+        to join it
+        """
+        return sum(
+            bucket.capacity
+            for buckets in (self.buckets, self.pool_buckets)
+            for bucket in buckets.values()
+            if bucket.enabled
+        )
+
+    def admit_pool(self) -> None:
+        """
+        Puts the pool keys in rotation, for when the server answered a request
+        made with the api keys
+        """
+        if not self.pool_buckets:
+            return
+        with self._lock:
+            # Swapped rather than updated, other threads may be reading it
+            self.buckets = {**self.buckets, **self.pool_buckets}
+            self.pool_buckets = {}
+
+    def bucket(self, key) -> TokenBucket:
+        return self.buckets[key]
+
+    def acquire(self) -> Tuple[str, float]:
+        """
+        Takes a token of the first key that has one, sleeping until one does.
+        Returns the key and the time spent waiting for it.
+        """
+        waited = 0.0
+        while True:
+            key, wait = self._take()
+            if wait is None:
+                return key, waited
+            self.buckets[key]._sleep(wait)
+            waited += wait
+
+    async def acquire_async(self) -> Tuple[str, float]:
+        waited = 0.0
+        while True:
+            key, wait = self._take()
+            if wait is None:
+                return key, waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def _take(self) -> Tuple[str, Optional[float]]:
+        """
+        Takes a token of a key in rotation, starting by the next one in turn.
+        Otherwise returns the key available soonest and the time to wait for it,
+        the wait is not spent on a key, all of them are tried again after it.
+        """
+        waits = {}
+        for key in self._rotation():
+            wait = self.buckets[key]._take()
+            if wait is None:
+                return key, None
+            waits[key] = wait
+        key = min(waits, key=waits.get)
+        return key, waits[key]
+
+    def _rotation(self) -> List[str]:
+        with self._lock:
+            keys = [key for key, bucket in self.buckets.items() if bucket.enabled]
+            if not keys:
+                raise NoKeysLeft("Every api key was refused by the server")
+            self._turn = (self._turn + 1) % len(keys)
+            return keys[self._turn :] + keys[: self._turn]
+
+    def refuse(self, key, seconds) -> bool:
+        """
+        Disables a key refused by the server for the given seconds, returns whether
+        other keys are left
+        """
+        self.buckets[key].disable(seconds)
+        return any(bucket.enabled for bucket in self.buckets.values())
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import F
+
+from api.models import Competition
+
+
+class ReadCounter:
+    """
+    Counts the reads of every league in memory and adds them to Competition.reads
+    at most every READ_COUNTS_FLUSH_INTERVAL seconds, a single UPDATE per league
+    instead of one per read. The refresh scheduler refreshes the most read leagues
+    first.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flushed_at = time.monotonic()
+
+    def count(self, league_code) -> bool:
+        """
+        Counts a read of the league, returns whether the counts are due to be
+        flushed
+        """
+        with self._lock:
+            self._pending[league_code] += 1
+            return (
+                time.monotonic() - self._flushed_at
+                >= settings.READ_COUNTS_FLUSH_INTERVAL
+            )
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        for league_code, reads in pending.items():
+            Competition.objects.filter(code=league_code).update(
+                reads=F("reads") + reads
+            )
+
+
+read_counter = ReadCounter()
@@ -0,0 +1,84 @@
+import time
+
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from api.jobs import run_jobs, start_refresh
+from api.models import Competition, ImportJob
+from api.rate_limit import get_rate_limiter
+
+
+def due_leagues() -> List[Competition]:
+    """
+    Leagues not refreshed for REFRESH_INTERVAL seconds, the most read since their
+    last refresh first. Leagues whose refresh failed in the last
+    REFRESH_RETRY_AFTER seconds wait.
+    """
+    now = timezone.now()
+    failed = ImportJob.objects.filter(
+        league_code=OuterRef("code"),
+        state=ImportJob.FAILED,
+        finished_at__gte=now - timedelta(seconds=settings.REFRESH_RETRY_AFTER),
+    )
+    return list(
+        Competition.objects.exclude(code=None)
+        .filter(
+            Q(refreshed_at=None)
+            | Q(refreshed_at__lt=now - timedelta(seconds=settings.REFRESH_INTERVAL))
+        )
+        .exclude(Exists(failed))
+        .order_by("-reads", F("refreshed_at").asc(nulls_first=True))
+    )
+
+
+def refresh_next_league(api_key) -> Optional[ImportJob]:
+    """
+    Syncs the first due league that has no import queued or running, user imports
+    go first. Its requests are paced to REFRESH_REQUESTS_PER_MINUTE, and with a
+    token shared with users they are only made while the server counts more
+    requests left than the rest of FOOTBALL_DATA_REQUESTS_PER_MINUTE. Whatever the
+    users spend is taken from the share of the refreshes, never the other way
+    round. Returns the job, None when no league is due.
+    """
+    get_rate_limiter(api_key, settings.REFRESH_REQUESTS_PER_MINUTE).reserve = max(
+        settings.FOOTBALL_DATA_REQUESTS_PER_MINUTE
+        - settings.REFRESH_REQUESTS_PER_MINUTE,
+        0,
+    )
+    for competition in due_leagues():
+        job = start_refresh(competition.code, api_key)
+        if job is None:
+            continue
+        # The pool is left to the imports users ask for
+        run_jobs(
+            [job],
+            requests_per_minute=settings.REFRESH_REQUESTS_PER_MINUTE,
+            api_keys=[api_key],
+        )
+        if job.state == ImportJob.SUCCEEDED:
+            # Reads counted while refreshing wait for the next one
+            Competition.objects.filter(pk=competition.pk).update(
+                reads=Greatest(F("reads") - competition.reads, 0)
+            )
+        return job
+    return None
+
+
+def run_scheduler(api_key, poll_interval=60.0, once=False) -> None:
+    """
+    Refreshes the due leagues one after the other. When none is due it either
+    waits poll_interval seconds or, if once is set, returns.
+    """
+    while True:
+        close_old_connections()
+        job = refresh_next_league(api_key)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
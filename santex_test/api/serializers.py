@@ -0,0 +1,103 @@
+from django.utils import timezone
+from rest_framework import serializers
+
+from api.models import Competition, ImportJob, LeagueSummary, Player, Team
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = [
+            "id",
+            "league_code",
+            "batch",
+            "mode",
+            "state",
+            "stage",
+            "timings",
+            "changes",
+            "metrics",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
+class LeagueCodesSerializer(serializers.Serializer):
+    codes = serializers.ListField(
+        child=serializers.CharField(max_length=32), allow_empty=False
+    )
+
+
+class CompetitionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Competition
+        fields = ["id", "name", "code", "area_name", "external_id", "player_count"]
+
+
+class TeamSerializer(serializers.ModelSerializer):
+    # Codes of the competitions the team plays, prefetched by TeamViewSet
+    competitions = serializers.SlugRelatedField(
+        many=True, read_only=True, slug_field="code"
+    )
+
+    class Meta:
+        model = Team
+        fields = [
+            "id",
+            "name",
+            "tla",
+            "short_name",
+            "area_name",
+            "email",
+            "external_id",
+            "competitions",
+        ]
+
+
+class PlayerTeamSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Team
+        fields = ["id", "name", "tla"]
+
+
+class PlayerSerializer(serializers.ModelSerializer):
+    # Joined in the same query by PlayerViewSet
+    team = PlayerTeamSerializer(read_only=True)
+
+    class Meta:
+        model = Player
+        fields = [
+            "id",
+            "name",
+            "position",
+            "date_of_birth",
+            "country_of_birth",
+            "nationality",
+            "external_id",
+            "team",
+        ]
+
+
+class LeagueSummarySerializer(serializers.ModelSerializer):
+    league_code = serializers.CharField(source="competition.code")
+    average_age = serializers.SerializerMethodField()
+
+    class Meta:
+        model = LeagueSummary
+        fields = [
+            "league_code",
+            "players",
+            "average_age",
+            "positions",
+            "nationalities",
+            "squads",
+            "refreshed_at",
+        ]
+
+    def get_average_age(self, summary):
+        if summary.average_date_of_birth is None:
+            return None
+        days = (timezone.now() - summary.average_date_of_birth).days
+        return round(days / 365.25, 1)
@@ -0,0 +1,105 @@
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Extract
+from django.utils import timezone
+
+from api.models import Competition, LeagueSummary, Player, Team
+
+
+# Players with no position or nationality are counted under this key
+UNKNOWN = "Unknown"
+
+
+def summarize(competition: Competition) -> LeagueSummary:
+    """
+    Works out the summary of the competition, unsaved, in two grouped queries: the
+    teams with their squad size, and the players by position and nationality along
+    with the sum of their dates of birth
+    """
+    squads = list(
+        Team.objects.filter(competitions=competition)
+        .annotate(players=Count("player"))
+        .order_by("name")
+        .values("id", "name", "tla", "players")
+    )
+    groups = (
+        Player.objects.filter(team__competitions=competition)
+        .values("position", "nationality")
+        .annotate(
+            players=Count("id"),
+            dated=Count("date_of_birth"),
+            epoch=Sum(Extract("date_of_birth", "epoch")),
+        )
+        .order_by()
+    )
+    positions, nationalities = Counter(), Counter()
+    dated, epoch = 0, 0
+    for group in groups:
+        positions[group["position"] or UNKNOWN] += group["players"]
+        nationalities[group["nationality"] or UNKNOWN] += group["players"]
+        dated += group["dated"]
+        epoch += group["epoch"] or 0
+
+    return LeagueSummary(
+        competition=competition,
+        players=sum(positions.values()),
+        average_date_of_birth=datetime.fromtimestamp(epoch / dated, timezone.utc)
+        if dated
+        else None,
+        positions=dict(positions.most_common()),
+        nationalities=dict(nationalities.most_common()),
+        squads=squads,
+    )
+
+
+SUMMARY_FIELDS = [
+    "players",
+    "average_date_of_birth",
+    "positions",
+    "nationalities",
+    "squads",
+    "refreshed_at",
+]
+
+
+def refresh_league_summaries(competitions) -> None:
+    """
+    Rewrites the summaries of the competitions. Called by the importer inside the
+    transaction writing their players, readers never see them out of date.
+    """
+    for competition in competitions:
+        summary = summarize(competition)
+        summary.refreshed_at = timezone.now()
+        updated = LeagueSummary.objects.filter(competition=competition).update(
+            **{field: getattr(summary, field) for field in SUMMARY_FIELDS}
+        )
+        if not updated:
+            summary.save()
+
+
+def get_league_summary(league_code) -> Optional[LeagueSummary]:
+    """
+    The summary of the league, None when the league is not imported. Leagues
+    imported before the summaries existed get theirs on their first read.
+    """
+    summary = (
+        LeagueSummary.objects.select_related("competition")
+        .filter(competition__code=league_code)
+        .first()
+    )
+    if summary is None:
+        competition = Competition.objects.filter(code=league_code).first()
+        if competition is None:
+            return None
+        summary = summarize(competition)
+        try:
+            with transaction.atomic():
+                summary.save()
+        except IntegrityError:
+            # Stored meanwhile by an import or another read
+            summary = LeagueSummary.objects.get(competition=competition)
+    return summary
@@ -1,169 +1,1699 @@
 # https://pytest-django.readthedocs.io/en/latest/helpers.html#id2
+import io
+import json
+import logging
 import os
+import threading
+import time
+
+from datetime import datetime, timedelta, timezone as dt_timezone
 
 import pytest
 import requests_mock
 
-from requests.exceptions import ConnectionError
-from django.db import Error as DBError
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from requests.exceptions import ConnectionError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import Error as DBError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import rate_limit
+from api.async_db import StreamingASGIHandler
+from api.bulk import CSVReader
+from api.fake_football_data import FakeFootballData
+from api.importer import PLAYER_FIELDS, LeagueImporter, PlayerRows
+from api.jobs import enqueue_import, run_next_jobs
+from api.json_log import JSONFormatter
+from api.metrics import ImportMetrics
+from api.models import (
+    Competition,
+    ImportCheckpoint,
+    ImportJob,
+    LeagueSummary,
+    Player,
+    Team,
+)
+from api.reads import read_counter
+from api.refresh import refresh_next_league
+from api.views import (
+    LeagueImportView,
+    async_liveness,
+    async_readiness,
+    async_total_players,
+)
+from api.football_data import (
+    AsyncFootballData,
+    CompetitionsTeamsError,
+    FootballData,
+    PlayerRecord,
+    TeamError,
+    compact_squad,
+)
+from api.http_cache import ResponseCache, get_response_cache
+from api.rate_limit import TokenBucket
+
+
+@pytest.fixture(autouse=True)
+def fresh_rate_limiters():
+    """
+    Every test starts with full buckets, otherwise the requests of the previous
+    tests would be throttling this one
+    """
+    rate_limit._rate_limiters.clear()
+    yield
+    rate_limit._rate_limiters.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_response_cache(settings, tmp_path):
+    """
+    Responses cached by a test must not be served to the next one
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = str(tmp_path / "football_data_cache")
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.mark.not_mocked
+def test_import_league_202(client, db):
+    """
+    HttpCode 202, {"message": "Import queued", "job_id": N} -->
+        When the import of the leagueCode was queued, the worker imports it.
+    """
+    response = client.get(
+        "/api/import-league/ELC", {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")}
+    )
+    assert response.status_code == 202
+    assert response.json()["message"] == "Import queued"
+
+    run_next_jobs()
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "succeeded"
+
+
+@pytest.mark.mocked
+def test_import_league_202_mocked(client, db):
+    """
+    HttpCode 202, {"message": "Import queued", "job_id": N} -->
+        When the import of the leagueCode was queued, the worker imports it.
+    """
+    response = import_mock_league(client)
+    assert response.status_code == 202
+    assert response.json()["message"] == "Import queued"
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "succeeded"
+    assert job["error"] is None
+    assert set(job["timings"]) == {"extract", "persist"}
+    assert "api_key" not in job
+
+
+@pytest.mark.mocked
+def test_import_league_409(client, db):
+    """
+    HttpCode 409, {"message": "League already imported"} -->
+        If the given leagueCode was already imported into the DB
+        (and in this case, it doesn't need to be imported again).
+    """
+    first_response = import_mock_league(client)
+    second_response = import_mock_league(client)
+    assert first_response.status_code == 202
+    assert first_response.json()["message"] == "Import queued"
+    assert second_response.status_code == 409
+    assert second_response.json()["message"] == "League already imported"
+
+
+@pytest.mark.mocked
+def test_sync_league_writes_only_the_changes(client, db):
+    """
+    A sync of a league already imported updates, inserts and deletes only the
+    players that changed, the rest keep their rows
+    """
+    import_mock_league(client)
+    tom = Player.objects.get(external_id=3996)
+    barry = Player.objects.get(external_id=4085)
+
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            json={
+                "id": 59,
+                "squad": [
+                    {
+                        "id": 3996,
+                        "name": "Tom Trybull",
+                        "position": "Defender",
+                        "dateOfBirth": "1993-03-09T00:00:00Z",
+                        "countryOfBirth": "Germany",
+                        "nationality": "Germany",
+                        "role": "PLAYER",
+                    },
+                    {
+                        "id": 4085,
+                        "name": "Barry Douglas",
+                        "position": "Defender",
+                        "dateOfBirth": "1989-09-04T00:00:00Z",
+                        "countryOfBirth": "Scotland",
+                        "nationality": "Scotland",
+                        "role": "PLAYER",
+                    },
+                    {
+                        "id": 8004,
+                        "name": "Bradley Johnson",
+                        "position": "Midfielder",
+                        "dateOfBirth": "1987-04-28T00:00:00Z",
+                        "countryOfBirth": "England",
+                        "nationality": "England",
+                        "role": "PLAYER",
+                    },
+                ],
+            },
+        )
+        response = client.get(
+            "/api/import-league/ELC", {"X-Auth-Token": "SOMETOKEN", "mode": "sync"}
+        )
+        run_next_jobs()
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "succeeded"
+    assert job["changes"]["players"] == {"inserted": 1, "updated": 1, "deleted": 0}
+    assert job["changes"]["teams"] == {
+        "inserted": 0,
+        "linked": 0,
+        "updated": 0,
+        "unlinked": 0,
+        "deleted": 0,
+    }
+    assert Player.objects.get(pk=tom.pk).position == "Defender"
+    assert Player.objects.get(pk=barry.pk).name == "Barry Douglas"
+    assert Competition.objects.get(code="ELC").player_count == 3
+    assert client.get("/api/stats/ELC").json()["positions"] == {
+        "Defender": 2,
+        "Midfielder": 1,
+    }
+
+
+@pytest.mark.mocked
+def test_import_league_400_missing_token(client, db):
+    """
+    HttpCode 400 -->
+        The worker has no way to import the league without a token.
+    """
+    response = client.get("/api/import-league/ELC")
+    assert response.status_code == 400
+    assert not ImportJob.objects.exists()
+
+
+@pytest.mark.mocked
+def test_import_league_not_found_mocked(client, db):
+    """
+    The job fails if the leagueCode was not found.
+    """
+    with requests_mock.Mocker() as mock:
+        # MOCK DEFINITION
+        mock.get(
+            "https://api.football-data.org/v2/competitions/SOMEBADCODE",
+            json={
+                "message": (
+                    "Parameter 'competitionId' is expected to be either an "
+                    "integer in a specified range or a competition code."
+                ),
+                "errorCode": 400,
+            },
+            headers={
+                "content-type": "application/json",
+                "X-Auth-Token": "SOMETOKEN",
+            },
+            status_code=400,
+        )
+
+        # MOCKED CALL
+        response = client.get(
+            "/api/import-league/SOMEBADCODE",
+            {"X-Auth-Token": "SOMETOKEN"},
+        )
+        run_next_jobs()
+
+    assert response.status_code == 202
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "failed"
+    assert job["stage"] == "extract"
+    assert job["error"].startswith("CompetitionNotFound")
+
+
+@pytest.mark.not_mocked
+def test_import_league_not_found(client, db):
+    """
+    The job fails if the leagueCode was not found.
+    """
+    response = client.get(
+        "/api/import-league/SOMEBADCODE",
+        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
+    )
+    run_next_jobs()
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "failed"
+    assert job["error"].startswith("CompetitionNotFound")
+
+
+@pytest.mark.mocked
+def test_import_league_504_db_error(client, db, monkeypatch):
+    """
+    HttpCode 504, {"message": "Server Error" } -->
+        If there is any connectivity issue with the DB server.
+    """
+
+    def raise_db_error(*args, **kwargs):
+        raise DBError("A mock exception")
+
+    monkeypatch.setattr(LeagueImportView, "the_league_exists", raise_db_error)
+
+    response = client.get(
+        "/api/import-league/ELC",
+        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
+    )
+    assert response.status_code == 504
+    assert response.json()["message"] == "Server Error"
+
+
+@pytest.mark.mocked
+def test_import_job_api_error(client, db, monkeypatch):
+    """
+    Connectivity issues with the football API are reported by the job
+    """
+
+    def raise_api_error(*args, **kwargs):
+        raise ConnectionError("A mock exception")
+
+    monkeypatch.setattr(FootballData, "get_competition", raise_api_error)
+
+    response = client.get(
+        "/api/import-league/ELC",
+        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
+    )
+    run_next_jobs()
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "failed"
+    assert job["error"] == "ConnectionError: A mock exception"
+    assert not Competition.objects.exists()
+
+
+@pytest.mark.mocked
+def test_finished_jobs_forget_the_token(client, db, monkeypatch):
+    """
+    The token of the caller is cleared once its job succeeds or fails
+    """
+    import_mock_league(client)
+    monkeypatch.setattr(FootballData, "get_competition", lambda *args: 1 / 0)
+    client.get("/api/import-league/XXX?X-Auth-Token=SOMETOKEN")
+    assert ImportJob.objects.get(league_code="XXX").api_key == "SOMETOKEN"
+    run_next_jobs()
+
+    assert list(ImportJob.objects.values_list("state", "api_key")) == [
+        (ImportJob.SUCCEEDED, ""),
+        (ImportJob.FAILED, ""),
+    ]
+
+
+@pytest.mark.mocked
+def test_pool_is_only_lent_to_tokens_the_server_takes(client, db, settings):
+    """
+    An import spends the pool of FOOTBALL_DATA_API_KEYS only once the token of the
+    caller was answered, a token the server refuses fails on its own
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    settings.FOOTBALL_DATA_API_KEYS = ["POOLKEY"]
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/competitions/ELC",
+            json={"message": "Your API token is invalid.", "errorCode": 400},
+            status_code=400,
+        )
+        client.get("/api/import-league/ELC?X-Auth-Token=BOGUS")
+        run_next_jobs()
+        bogus_keys = {r.headers["X-Auth-Token"] for r in mock.request_history}
+
+    assert bogus_keys == {"BOGUS"}
+    assert ImportJob.objects.get().state == ImportJob.FAILED
+
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+        keys = [r.headers["X-Auth-Token"] for r in mock.request_history]
+
+    assert keys[0] == "SOMETOKEN"
+    assert set(keys) == {"SOMETOKEN", "POOLKEY"}
+
+
+@pytest.mark.mocked
+def test_import_job_404(client, db):
+    response = client.get("/api/import-jobs/1234")
+    assert response.status_code == 404
+    assert response.json()["message"] == "Not found"
+
+
+@pytest.mark.mocked
+def test_import_league_shares_the_active_import(client, db):
+    """
+    HttpCode 202 -->
+        A second request while the league is being imported gets the same job.
+    """
+    first = client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+    ImportJob.objects.update(state=ImportJob.RUNNING, started_at=timezone.now())
+    second = client.get("/api/import-league/ELC?X-Auth-Token=OTHERTOKEN")
+
+    assert second.status_code == 202
+    assert second.json()["message"] == "Import already in progress"
+    assert second.json()["job_id"] == first.json()["job_id"]
+    assert ImportJob.objects.count() == 1
+
+
+@pytest.mark.mocked
+def test_import_league_replaces_an_abandoned_import(client, db, settings):
+    settings.IMPORT_JOB_STALE_AFTER = 60
+    first = client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+    ImportJob.objects.update(
+        state=ImportJob.RUNNING, started_at=timezone.now() - timedelta(seconds=61)
+    )
+    second = client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+
+    assert second.json()["message"] == "Import queued"
+    assert second.json()["job_id"] != first.json()["job_id"]
+    abandoned = ImportJob.objects.get(pk=first.json()["job_id"])
+    assert abandoned.state == ImportJob.FAILED
+    assert abandoned.error.startswith("Abandoned")
+
+
+@pytest.mark.mocked
+def test_failed_import_is_resumed_from_its_checkpoints(client, db, settings):
+    """
+    A retry of an import that failed on a squad requests that squad only
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        mock.get(
+            "https://api.football-data.org/v2/competitions/2016/teams",
+            json={
+                "teams": [
+                    {
+                        "id": 59,
+                        "name": "Blackburn Rovers FC",
+                        "tla": "BBR",
+                        "shortName": "Blackburn",
+                        "area": {"id": 2072, "name": "England"},
+                    },
+                    {
+                        "id": 60,
+                        "name": "Bristol City FC",
+                        "tla": "BRC",
+                        "shortName": "Bristol City",
+                        "area": {"id": 2072, "name": "England"},
+                    },
+                ]
+            },
+        )
+        mock.get(
+            "https://api.football-data.org/v2/teams/60",
+            [{"status_code": 500}, {"json": {"id": 60, "squad": []}}],
+        )
+        failed = client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+        resumed = client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN")
+        history = len(mock.request_history)
+        run_next_jobs()
+        retried = [request.path for request in mock.request_history[history:]]
+
+    failed_job = ImportJob.objects.get(pk=failed.json()["job_id"])
+    assert failed_job.error == "TeamError: Failed to retrieve Team 60"
+    job = ImportJob.objects.get(pk=resumed.json()["job_id"])
+    assert job.state == ImportJob.SUCCEEDED
+    assert retried == ["/v2/teams/60"]
+    assert job.metrics["stages"]["extract"]["resumed"] == 3
+    assert Player.objects.filter(team__tla="BBR").count() == 2
+    assert not ImportCheckpoint.objects.exists()
+
+
+@pytest.mark.mocked
+def test_sync_ignores_checkpoints_fetched_long_ago(client, db, settings):
+    """
+    A sync does not write the payloads a failed import fetched an hour ago
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    import_mock_league(client)
+    checkpoint = ImportCheckpoint.objects.create(
+        league_code="ELC",
+        step=ImportCheckpoint.COMPETITION,
+        payload={"id": 2016, "name": "Stale", "area": {"name": "England"}},
+    )
+    ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(
+        created_at=timezone.now() - timedelta(hours=1)
+    )
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        client.get("/api/import-league/ELC?X-Auth-Token=SOMETOKEN&mode=sync")
+        run_next_jobs()
+
+    assert Competition.objects.get(code="ELC").name == "Championship"
+    assert not ImportCheckpoint.objects.exists()
+
+
+@pytest.mark.mocked
+def test_import_leagues_batch(client, db):
+    """
+    HttpCode 202 -->
+        Leagues are imported together, squads of shared teams are fetched once.
+    """
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        mock_cup(mock)
+        response = client.post(
+            "/api/import-leagues?X-Auth-Token=SOMETOKEN",
+            {"codes": ["ELC", "FLC", "ELC"]},
+            content_type="application/json",
+        )
+        run_next_jobs()
+        squad_requests = [
+            request
+            for request in mock.request_history
+            if request.path == "/v2/teams/59"
+        ]
+
+    assert response.status_code == 202
+    assert list(response.json()["jobs"]) == ["ELC", "FLC"]
+    for job_id in response.json()["jobs"].values():
+        job = client.get(f"/api/import-jobs/{job_id}").json()
+        assert job["state"] == "succeeded"
+    assert len(squad_requests) == 1
+    assert Team.objects.filter(external_id=59).count() == 1
+    assert Player.objects.filter(team__tla="BBR").count() == 2
+    assert client.get("/api/total-players/FLC").json()["total"] == 2
+
+
+@pytest.mark.mocked
+def test_import_league_links_the_teams_already_stored(client, db):
+    """
+    A team imported with another league is linked, its squad is not fetched again
+    """
+    import_mock_league(client)
+    with requests_mock.Mocker() as mock:
+        mock_cup(mock)
+        client.get("/api/import-league/FLC?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+        squad_requests = [
+            request
+            for request in mock.request_history
+            if request.path == "/v2/teams/59"
+        ]
+
+    assert squad_requests == []
+    team = Team.objects.get(external_id=59)
+    assert sorted(team.competitions.values_list("code", flat=True)) == ["ELC", "FLC"]
+    assert client.get("/api/total-players/FLC").json()["total"] == 2
+
+
+@pytest.mark.mocked
+def test_refresh_syncs_the_most_read_league_first(client, db):
+    """
+    Due leagues are refreshed by how often they were read, with the refresh token,
+    and leagues with an import in progress are left to it
+    """
+    import_mock_league(client)
+    with requests_mock.Mocker() as mock:
+        mock_cup(mock)
+        client.get("/api/import-league/FLC?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+    Competition.objects.update(refreshed_at=timezone.now() - timedelta(days=1))
+    Competition.objects.filter(code="FLC").update(reads=5)
+    Competition.objects.filter(code="ELC").update(reads=1)
+
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        mock_cup(mock)
+        first = refresh_next_league("REFRESHTOKEN")
+        enqueue_import("ELC", "SOMETOKEN", mode=ImportJob.SYNC)
+        second = refresh_next_league("REFRESHTOKEN")
+
+    assert first.league_code == "FLC"
+    assert first.state == ImportJob.SUCCEEDED
+    assert {r.headers["X-Auth-Token"] for r in mock.request_history} == {"REFRESHTOKEN"}
+    flc = Competition.objects.get(code="FLC")
+    assert flc.reads == 0
+    assert flc.refreshed_at > timezone.now() - timedelta(minutes=1)
+    assert second is None
+
+
+@pytest.mark.mocked
+def test_reads_of_a_league_are_counted(client, db, settings):
+    settings.READ_COUNTS_FLUSH_INTERVAL = 0
+    # Drops the reads counted by the previous tests, their leagues are gone
+    read_counter.flush()
+    import_mock_league(client)
+    client.get("/api/total-players/ELC")
+    client.get("/api/stats/ELC")
+
+    assert Competition.objects.get(code="ELC").reads == 2
+
+
+@pytest.mark.mocked
+def test_import_leagues_batch_is_queued_at_once(client, db, monkeypatch):
+    """
+    HttpCode 504 -->
+        A batch failing halfway leaves nothing queued for a worker to claim.
+    """
+
+    def enqueue_or_fail(league_code, *args, **kwargs):
+        if league_code == "FLC":
+            raise DBError("A mock exception")
+        return enqueue_import(league_code, *args, **kwargs)
+
+    monkeypatch.setattr("api.jobs.enqueue_import", enqueue_or_fail)
+    response = client.post(
+        "/api/import-leagues?X-Auth-Token=SOMETOKEN",
+        {"codes": ["ELC", "FLC"]},
+        content_type="application/json",
+    )
+
+    assert response.status_code == 504
+    assert not ImportJob.objects.exists()
+
+
+@pytest.mark.mocked
+def test_concurrent_imports_share_their_teams(transactional_db):
+    """
+    Of two leagues sharing a team persisted at once, the second waits for the
+    first to store the team and links it
+    """
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        mock_cup(mock)
+        importer = LeagueImporter(FootballData("SOMETOKEN"))
+        league = importer.extract_data("ELC")
+        cup = importer.extract_data("FLC")
+    persisting = threading.Event()
+    errors = []
+
+    def persist_cup():
+        persisting.wait()
+        try:
+            with transaction.atomic():
+                LeagueImporter(FootballData("SOMETOKEN")).persist_data(*cup)
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=persist_cup)
+    thread.start()
+    with transaction.atomic():
+        importer.persist_data(*league)
+        persisting.set()
+        # The cup reaches the shared team before the league is committed
+        time.sleep(0.5)
+    thread.join()
+
+    assert errors == []
+    assert Team.objects.filter(external_id=59).count() == 1
+    assert Competition.objects.get(code="FLC").player_count == 2
+
+
+@pytest.mark.mocked
+def test_import_leagues_batch_400(client, db):
+    response = client.post(
+        "/api/import-leagues?X-Auth-Token=SOMETOKEN",
+        {"codes": []},
+        content_type="application/json",
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.mocked
+def test_list_players_filtered_by_nationality(client, db, django_assert_num_queries):
+    """
+    HttpCode 200 -->
+        A page of players with their team, in a single query.
+    """
+    import_mock_league(client)
+    with django_assert_num_queries(1):
+        response = client.get("/api/players", {"nationality": "Germany"})
+
+    assert response.status_code == 200
+    assert response.json()["next"] is None
+    [player] = response.json()["results"]
+    assert player["name"] == "Tom Trybull"
+    assert player["team"]["tla"] == "BBR"
+
+
+@pytest.mark.mocked
+def test_list_players_by_cursor(client, db):
+    import_mock_league(client)
+    first = client.get("/api/players", {"page_size": 1, "competition": "ELC"}).json()
+    second = client.get(first["next"]).json()
+
+    assert "count" not in first
+    assert len(first["results"]) == len(second["results"]) == 1
+    assert first["results"][0]["id"] < second["results"][0]["id"]
+
+
+@pytest.mark.mocked
+def test_list_teams_with_their_competitions(client, db, django_assert_num_queries):
+    import_mock_league(client)
+    with django_assert_num_queries(2):
+        response = client.get("/api/teams", {"area": "England"})
+    [team] = response.json()["results"]
+    assert team["competitions"] == ["ELC"]
+
+    response = client.get(f"/api/teams/{team['id']}")
+    assert response.json()["tla"] == "BBR"
+    assert client.get("/api/competitions", {"code": "ELC"}).json()["count"] == 1
+
+
+@pytest.mark.mocked
+def test_league_stats(client, db, django_assert_num_queries):
+    """
+    HttpCode 200 -->
+        The breakdowns are read from the summary stored by the import.
+    """
+    import_mock_league(client)
+    with django_assert_num_queries(1):
+        response = client.get("/api/stats/ELC")
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["players"] == 2
+    assert stats["positions"] == {"Midfielder": 1, "Defender": 1}
+    assert stats["nationalities"] == {"Germany": 1, "Scotland": 1}
+    assert [squad["players"] for squad in stats["squads"]] == [2]
+    assert stats["average_age"] > 30
+    assert client.get("/api/stats/XXX").status_code == 404
+
+
+@pytest.mark.mocked
+def test_league_stats_of_a_league_imported_before_the_summaries(client, db):
+    import_mock_league(client)
+    LeagueSummary.objects.all().delete()
+
+    assert client.get("/api/stats/ELC").json()["players"] == 2
+    assert LeagueSummary.objects.count() == 1
+
+
+@pytest.mark.mocked
+def test_export_league_streams_csv(client, db):
+    import_mock_league(client)
+    response = client.get("/api/export/ELC")
+
+    assert response.status_code == 200
+    assert response.streaming
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines[0].startswith("external_id,name,position,date_of_birth")
+    assert lines[1].startswith("3996,Tom Trybull,Midfielder,1993-03-09")
+    assert len(lines) == 3
+    assert client.get("/api/export/ELC", {"table": "rows"}).status_code == 400
+    assert client.get("/api/export/XXX").status_code == 404
+
+
+@pytest.mark.mocked
+def test_export_league_streams_under_asgi(client, transactional_db):
+    """
+    Served by santex_test/asgi.py the export is read from a thread of its own
+    """
+    import_mock_league(client)
+
+    async def export():
+        communicator = ApplicationCommunicator(
+            StreamingASGIHandler(),
+            {
+                "type": "http",
+                "method": "GET",
+                "path": "/api/export/ELC",
+                "query_string": b"",
+                "headers": [],
+            },
+        )
+        await communicator.send_input({"type": "http.request"})
+        start = await communicator.receive_output(5)
+        body = []
+        while not body or body[-1].get("more_body"):
+            body.append(await communicator.receive_output(5))
+        return start, body
+
+    start, body = async_to_sync(export)()
+
+    assert start["status"] == 200
+    lines = b"".join(m.get("body", b"") for m in body).decode().splitlines()
+    assert lines[0].startswith("external_id,name,position,date_of_birth")
+    assert lines[1].startswith("3996,Tom Trybull,Midfielder,1993-03-09")
+    assert len(lines) == 3
+
+
+@pytest.mark.mocked
+def test_export_league_command_reads_in_chunks(client, db, tmp_path):
+    import_mock_league(client)
+    output = tmp_path / "teams.csv"
+    call_command(
+        "export_league", "ELC", table="teams", output=str(output), chunk_size=1
+    )
+
+    assert output.read_text().splitlines() == [
+        "external_id,name,tla,short_name,area_name,email",
+        "59,Blackburn Rovers FC,BBR,Blackburn,England,",
+    ]
+
+
+def write_dump(fake: FakeFootballData, directory):
+    """
+    Saves the leagues of the stand-in as a dump, under the paths of the api
+    """
+    for code, (competition_id, teams) in fake.leagues.items():
+        teams_dir = directory / "competitions" / str(competition_id)
+        teams_dir.mkdir(parents=True)
+        (directory / "competitions" / f"{code}.json").write_text(
+            json.dumps(fake.competition(code))
+        )
+        raw_teams = fake.teams(competition_id)
+        (teams_dir / "teams.json").write_text(json.dumps(raw_teams))
+        (directory / "teams").mkdir(exist_ok=True)
+        for team in raw_teams["teams"]:
+            (directory / "teams" / f"{team['id']}.json").write_text(
+                json.dumps(fake.team(team["id"]))
+            )
+
+
+def player_indexes():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s ORDER BY 1",
+            [Player._meta.db_table],
+        )
+        return cursor.fetchall()
+
+
+@pytest.mark.mocked
+def test_load_football_dump_copies_the_players_from_workers(
+    client, transactional_db, tmp_path
+):
+    import_mock_league(client)
+    write_dump(FakeFootballData({"AAA": 3, "BBB": 2}, players_per_team=5), tmp_path)
+    (tmp_path / "competitions" / "ELC.json").write_text("{}")
+    indexes = player_indexes()
+    out = io.StringIO()
+    call_command(
+        "load_football_dump", str(tmp_path), workers=2, defer_indexes=True, stdout=out
+    )
+
+    assert "Already imported: ELC" in out.getvalue()
+    assert "Loaded 2 leagues, 5 teams and 25 players" in out.getvalue()
+    assert Competition.objects.get(code="AAA").player_count == 15
+    assert Competition.objects.get(code="BBB").summary.players == 10
+    assert Player.objects.filter(team__competitions__code="BBB").count() == 10
+    assert Competition.objects.get(code="ELC").player_count == 2
+    assert player_indexes() == indexes
+
+
+@pytest.mark.mocked
+def test_load_football_dump_links_teams_already_stored(
+    client, db, tmp_path, monkeypatch
+):
+    # The indexes are only dropped with --defer-indexes
+    monkeypatch.setattr("api.dump.deferred_indexes", None)
+    fake = FakeFootballData({"AAA": 2, "BBB": 2}, players_per_team=3)
+    write_dump(fake, tmp_path)
+    # BBB plays with the first team of AAA, whose squad is loaded once
+    shared = fake.team(1000 * 1000, squad=False)
+    (tmp_path / "competitions" / "1001" / "teams.json").write_text(
+        json.dumps({"teams": [shared] + fake.teams(1001)["teams"]})
+    )
+    call_command("load_football_dump", str(tmp_path), workers=1, stdout=io.StringIO())
+
+    assert Team.objects.count() == 4
+    assert Player.objects.count() == 12
+    assert Competition.objects.get(code="BBB").player_count == 9
+    assert LeagueSummary.objects.get(competition__code="AAA").players == 6
+
+
+def migrate(migration=None):
+    """
+    Migrates the test database to the migration of the api, the latest one by
+    default, and returns the models as they are at it
+    """
+    executor = MigrationExecutor(connection)
+    targets = [("api", migration)] if migration else executor.loader.graph.leaf_nodes()
+    executor.migrate(targets)
+    return MigrationExecutor(connection).loader.project_state(targets).apps
+
+
+def seed_team(apps, competition, external_id=None):
+    Team = apps.get_model("api", "Team")
+    Player = apps.get_model("api", "Player")
+    fields = {"external_id": external_id} if external_id else {}
+    team = Team.objects.create(
+        competition=competition,
+        name="Arsenal FC",
+        tla="ARS",
+        short_name="Arsenal",
+        area_name="England",
+        email="",
+        **fields,
+    )
+    Player.objects.create(
+        team=team,
+        name="Bukayo Saka",
+        position="Attacker",
+        country_of_birth="England",
+        nationality="England",
+    )
+    return team
+
+
+@pytest.mark.mocked
+def test_migration_removes_duplicated_competitions(transactional_db):
+    """
+    The competitions stored twice, with their teams and players, are deleted in
+    the migration that makes the code unique
+    """
+    apps = migrate("0006_competition_player_count")
+    try:
+        Competition = apps.get_model("api", "Competition")
+        for _ in range(2):
+            competition = Competition.objects.create(
+                name="Premier League", code="PL", area_name="England"
+            )
+            seed_team(apps, competition)
+
+        apps = migrate("0007_lookup_indexes")
+        assert apps.get_model("api", "Competition").objects.count() == 1
+        assert apps.get_model("api", "Player").objects.count() == 1
+    finally:
+        migrate()
+
+
+@pytest.mark.mocked
+def test_migration_merges_the_teams_of_a_club(transactional_db):
+    """
+    A club imported for two competitions is merged into one team playing both
+    """
+    apps = migrate("0009_external_ids")
+    try:
+        Competition = apps.get_model("api", "Competition")
+        for code in ("PL", "CL"):
+            competition = Competition.objects.create(
+                name=code, code=code, area_name="Europe"
+            )
+            seed_team(apps, competition, external_id=57)
+
+        apps = migrate("0010_shared_teams")
+        team = apps.get_model("api", "Team").objects.get()
+        assert sorted(team.competitions.values_list("code", flat=True)) == [
+            "CL",
+            "PL",
+        ]
+        assert apps.get_model("api", "Player").objects.count() == 1
+    finally:
+        migrate()
+
+
+@pytest.mark.mocked
+def test_count_players_200_mocked(client, db):
+    """
+    HttpCode 200, {"total" : N } -->
+        Counting players of an existsing league
+    """
+    import_mock_league(client)
+    response = client.get("/api/total-players/ELC", {"X-Auth-Token": "NOTOKEN"})
+    assert response.status_code == 200
+    assert response.json()["total"] == 2
+
+
+@pytest.mark.mocked
+def test_count_players_404_mocked(client, db):
+    """
+    HttpCode 404, {"message": "Not Found"} -->
+        Counting players of an unexisting league
+    """
+    import_mock_league(client)
+    response = client.get("/api/total-players/BADLEAGUE", {"X-Auth-Token": "NOTOKEN"})
+    assert response.status_code == 404
+    assert response.json()["message"] == "Not found"
+
+
+@pytest.mark.mocked
+def test_count_players_is_cached(client, db, django_assert_num_queries):
+    """
+    Counts are answered from the cache, and clients can revalidate them
+    """
+    import_mock_league(client)
+    first_response = client.get("/api/total-players/ELC")
+    assert first_response.json()["total"] == 2
+    assert "max-age" in first_response["Cache-Control"]
+
+    with django_assert_num_queries(0):
+        second_response = client.get(
+            "/api/total-players/ELC", HTTP_IF_NONE_MATCH=first_response["ETag"]
+        )
+    assert second_response.status_code == 304
+
+
+@pytest.mark.mocked
+def test_persist_data_does_not_query_the_teams_back(db, django_assert_num_queries):
+    """
+    The competition, the lock and the lookup of the teams already stored, the
+    teams, their links to the competition, the players and the player count take
+    one query each. The summary takes two to work out and two to store.
+    """
+    raw_competition, raw_teams, raw_players = mock_league_data()
+    importer = LeagueImporter(FootballData("SOMETOKEN"))
+    with django_assert_num_queries(11):
+        importer.persist_data(raw_competition, raw_teams, raw_players)
+
+    assert Player.objects.filter(team__tla="BBR").count() == 2
+
+
+@pytest.mark.mocked
+def test_persist_data_copies_large_squads(db, settings):
+    """
+    Players written by COPY are the same as the ones bulk created, and the COPY
+    counts as a query of its stage
+    """
+    settings.IMPORT_COPY_THRESHOLD = 1
+    raw_competition, raw_teams, raw_players = mock_league_data()
+    raw_players["BBR"].append(
+        PlayerRecord('Jan "The Wall" Paul', None, None, "Slovakia", "Slovakia")
+    )
+    metrics = ImportMetrics()
+    LeagueImporter(FootballData("SOMETOKEN"), metrics=metrics).persist_data(
+        raw_competition, raw_teams, raw_players
+    )
+
+    player = Player.objects.get(name="Tom Trybull")
+    assert player.team.tla == "BBR"
+    assert player.date_of_birth.year == 1993
+    # None is stored as NULL, not as an empty string
+    assert Player.objects.filter(
+        name='Jan "The Wall" Paul', position=None, date_of_birth=None
+    ).exists()
+    assert Competition.objects.get(code="ELC").player_count == 3
+    assert metrics.stages["persist.players"]["queries"] == 1
+    assert metrics.stages["persist.players"]["query_seconds"] > 0
+
+
+@pytest.mark.mocked
+def test_import_league_from_the_stand_in(client, db, settings):
+    """
+    Requests rate limited by the stand-in are retried once its counter resets
+    """
+    with FakeFootballData(
+        {"SYN": 5}, players_per_team=3, requests_per_window=2, window=0.2
+    ) as fake:
+        settings.FOOTBALL_DATA_URL = fake.url
+        response = client.get("/api/import-league/SYN?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "succeeded"
+    assert fake.stats["rate_limited"] > 0
+    assert fake.stats["requests"] == 7 + fake.stats["rate_limited"]
+    assert client.get("/api/total-players/SYN").json()["total"] == 15
+
+
+class FakeFootballDataMissingATeam(FakeFootballData):
+    def team(self, team_id, squad=True):
+        return None if team_id == 1000003 else super().team(team_id, squad)
+
+
+@pytest.mark.mocked
+def test_squads_fetched_before_a_failure_are_kept(settings):
+    """
+    When a squad fails the ones requested along with it are still kept, by both
+    clients, so a resumed import does not request them again
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    team_ids = list(range(1000000, 1000006))
+
+    async def get_squads_async(url, fetched):
+        async with AsyncFootballData("SOMETOKEN", base_url=url) as football_data:
+            await football_data.get_squads(team_ids, fetched)
+
+    for get_squads in (
+        lambda url, fetched: FootballData("SOMETOKEN", base_url=url).get_squads(
+            team_ids, fetched
+        ),
+        async_to_sync(get_squads_async),
+    ):
+        rate_limit._rate_limiters.clear()
+        fetched = {}
+        with FakeFootballDataMissingATeam({"SYN": 6}, latency=0.1) as fake:
+            with pytest.raises(TeamError):
+                get_squads(fake.url, fetched)
+
+        assert fake.stats["requests"] == 6
+        assert sorted(fetched) == [1000000, 1000001, 1000002, 1000004, 1000005]
+
+
+@pytest.mark.mocked
+def test_async_client_gets_the_squads(settings):
+    """
+    Rate limited requests of the async client wait on the event loop for the reset
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+
+    async def get_squads(url):
+        async with AsyncFootballData("SOMETOKEN", base_url=url) as football_data:
+            return await football_data.get_squads([1000000, 1000001, 1000002])
+
+    with FakeFootballData(
+        {"SYN": 3}, players_per_team=2, requests_per_window=1, window=0.2
+    ) as fake:
+        squads = async_to_sync(get_squads)(fake.url)
+
+    assert fake.stats["rate_limited"] > 0
+    assert [len(squad) for squad in squads.values()] == [2, 2, 2]
+    assert squads[1000001][0].name == "Player 1000001-0"
+
+
+@pytest.mark.mocked
+def test_import_league_with_the_async_client(client, db, settings):
+    settings.FOOTBALL_DATA_ASYNC = True
+    with FakeFootballData({"SYN": 4}, players_per_team=3) as fake:
+        settings.FOOTBALL_DATA_URL = fake.url
+        response = client.get("/api/import-league/SYN?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
 
-from api.views import LeagueImportView
-from api.football_data import FootballData
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    assert job["state"] == "succeeded"
+    stages = job["metrics"]["stages"]
+    assert stages["extract"]["api_calls"] == 6
+    # Checkpoints are saved from another thread, their queries still count
+    assert stages["extract.competition"]["queries"] == 1
+    assert stages["extract.squads"]["queries"] >= 1
+    assert client.get("/api/total-players/SYN").json()["total"] == 12
 
 
-@pytest.mark.not_mocked
-def test_import_league_201(client, db):
+@pytest.mark.benchmark(group="import")
+@pytest.mark.parametrize("teams", [20, 100, 500])
+def test_benchmark_import_league(benchmark, client, db, settings, teams):
     """
-    HttpCode 201, {"message": "Successfully imported"} -->
-        When the leagueCode was successfully imported.
+    Imports a synthetic league through the view and the worker, without spending
+    the quota. Run with pytest -m benchmark
     """
-    response = client.get(
-        "/api/import-league/ELC", {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")}
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    settings.FOOTBALL_DATA_REQUESTS_PER_MINUTE = 600
+
+    def setup():
+        Competition.objects.all().delete()
+        Team.objects.all().delete()
+        # Every round starts with a full bucket
+        rate_limit._rate_limiters.clear()
+
+    def import_league():
+        client.get("/api/import-league/SYN?X-Auth-Token=SOMETOKEN")
+        run_next_jobs()
+
+    with FakeFootballData({"SYN": teams}) as fake:
+        settings.FOOTBALL_DATA_URL = fake.url
+        benchmark.pedantic(import_league, setup=setup, rounds=3)
+
+    assert Competition.objects.get(code="SYN").player_count == teams * 25
+
+
+@pytest.mark.mocked
+def test_player_rows_normalize_squads_by_column():
+    player_rows = PlayerRows()
+    rows = player_rows(
+        [
+            PlayerRecord(
+                " Tom Trybull ",
+                "Midfielder",
+                "1993-03-09T00:00:00Z",
+                "Germany",
+                "Germany",
+                3996,
+            ),
+            PlayerRecord("X" * 300, None, None, "Spain", "Spain", 3997),
+        ],
+        team_id=7,
+    )
+    player_rows(
+        [
+            PlayerRecord(
+                "Ben Gibson",
+                "Defender",
+                "1993-03-09T00:00:00Z",
+                "England",
+                "England",
+                3998,
+            )
+        ],
+        8,
     )
-    assert response.status_code == 201
-    assert response.json()["message"] == "Successfully imported"
+
+    assert [dict(zip(PLAYER_FIELDS, row)) for row in rows] == [
+        {
+            "name": "Tom Trybull",
+            "position": "Midfielder",
+            "date_of_birth": datetime(1993, 3, 9, tzinfo=dt_timezone.utc),
+            "country_of_birth": "Germany",
+            "nationality": "Germany",
+            "team_id": 7,
+            "external_id": 3996,
+        },
+        {
+            "name": "X" * 256,
+            "position": None,
+            "date_of_birth": None,
+            "country_of_birth": "Spain",
+            "nationality": "Spain",
+            "team_id": 7,
+            "external_id": 3997,
+        },
+    ]
+    # The date shared by the two squads was parsed once
+    assert sorted(player_rows.dates, key=str) == ["1993-03-09T00:00:00Z", None]
+    assert player_rows([], 7) == []
+    assert player_rows.cut == {"name": 1}
+
+
+@pytest.mark.mocked
+def test_player_rows_parse_dates_and_log_what_they_drop(caplog):
+    """
+    Dates without a time are stored at midnight, values that are not dates are
+    stored as null and logged
+    """
+    player_rows = PlayerRows()
+    rows = player_rows(
+        [
+            PlayerRecord("A", None, "1993-03-09", None, None, 1),
+            PlayerRecord("B", None, "1993-02-30", None, None, 2),
+            PlayerRecord("C", None, "unknown", None, None, 3),
+        ],
+        team_id=7,
+    )
+
+    assert [row[PLAYER_FIELDS.index("date_of_birth")] for row in rows] == [
+        datetime(1993, 3, 9, tzinfo=dt_timezone.utc),
+        None,
+        None,
+    ]
+    assert player_rows.unparsed == 2
+    assert sorted(record.value for record in caplog.records) == [
+        "1993-02-30",
+        "unknown",
+    ]
+
+
+def player_objects(squads):
+    """
+    Rows built a Player at a time, as the importer did before PlayerRows
+    """
+    return [
+        tuple(getattr(player, field) for field in PLAYER_FIELDS)
+        for team_id, raw_players in squads
+        for player in [
+            Player(
+                name=p.name,
+                position=p.position,
+                date_of_birth=parse_datetime(p.date_of_birth)
+                if p.date_of_birth
+                else None,
+                country_of_birth=p.country_of_birth,
+                nationality=p.nationality,
+                team_id=team_id,
+                external_id=p.id,
+            )
+            for p in raw_players
+        ]
+    ]
+
+
+def player_columns(squads):
+    player_rows = PlayerRows()
+    return [
+        row
+        for team_id, raw_players in squads
+        for row in player_rows(raw_players, team_id)
+    ]
+
+
+@pytest.mark.benchmark(group="player_rows")
+@pytest.mark.parametrize("build", [player_objects, player_columns])
+def test_benchmark_player_rows(benchmark, build):
+    """
+    Builds the rows of a league of 400 squads of 25 players. Run with
+    pytest -m benchmark
+    """
+    fake = FakeFootballData({"SYN": 400})
+    squads = [
+        (team_id, compact_squad(fake.team(team_id)["squad"]))
+        for team_id in range(1000, 1400)
+    ]
+    rows = benchmark(build, squads)
+
+    assert rows == player_objects(squads)
 
 
 @pytest.mark.mocked
-def test_import_league_201_mocked(client, db):
+def test_import_job_records_its_metrics(client, db):
     """
-    HttpCode 201, {"message": "Successfully imported"} -->
-        When the leagueCode was successfully imported.
+    Every stage of the job records its time, queries and requests, and the totals
+    are exposed at /metrics
     """
     response = import_mock_league(client)
-    assert response.status_code == 201
-    assert response.json()["message"] == "Successfully imported"
+
+    job = client.get(f"/api/import-jobs/{response.json()['job_id']}").json()
+    stages = job["metrics"]["stages"]
+    assert stages["extract"]["api_calls"] == 3
+    assert stages["extract.squads"]["api_calls"] == 1
+    assert stages["extract"]["bytes"] > 0
+    assert stages["persist"]["queries"] >= 6
+    assert stages["persist.players"]["queries"] == 1
+    assert job["metrics"]["requests"]["squad"]["calls"] == 1
+
+    metrics = client.get("/metrics")
+    assert metrics["Content-Type"].startswith("text/plain")
+    body = metrics.content.decode()
+    assert 'import_jobs_finished_total{mode="import",state="succeeded"} 1.0' in body
+    assert 'import_stage_api_requests_total{stage="extract"} 3.0' in body
+    assert 'football_data_requests_total{endpoint="squad"} 1.0' in body
+    assert 'import_jobs{state="succeeded"} 1' in body
 
 
 @pytest.mark.mocked
-def test_import_league_409(client, db):
+def test_json_log_lines_carry_the_extra_fields():
+    record = logging.makeLogRecord(
+        {"name": "api.jobs", "msg": "Import %s", "args": ("succeeded",)}
+    )
+    record.league_code = "ELC"
+    line = json.loads(JSONFormatter().format(record))
+    assert line["message"] == "Import succeeded"
+    assert line["league_code"] == "ELC"
+    assert "args" not in line
+
+
+@pytest.mark.mocked
+def test_async_views_answer_as_the_sync_ones(client, db, rf):
     """
-    HttpCode 409, {"message": "League already imported"} -->
-        If the given leagueCode was already imported into the DB
-        (and in this case, it doesn't need to be imported again).
+    Served from asgi.py the player count and the health checks are async views
     """
-    first_response = import_mock_league(client)
-    second_response = import_mock_league(client)
-    assert first_response.status_code == 201
-    assert first_response.json()["message"] == "Successfully imported"
-    assert second_response.status_code == 409
-    assert second_response.json()["message"] == "League already imported"
+    import_mock_league(client)
+    sync_response = client.get("/api/total-players/ELC")
+    response = async_to_sync(async_total_players)(rf.get("/"), "ELC")
+
+    assert json.loads(response.content) == {"total": 2}
+    assert response["ETag"] == sync_response["ETag"]
+    assert async_to_sync(async_total_players)(rf.post("/"), "ELC").status_code == 405
+    assert async_to_sync(async_liveness)(rf.get("/")).status_code == 200
+    assert async_to_sync(async_readiness)(rf.get("/")).status_code == 200
+
+
+@pytest.mark.mocked
+def test_health_checks(client, db):
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").json() == {"status": "ok"}
+
+
+@pytest.mark.mocked
+def test_readiness_503_db_error(client, db, monkeypatch):
+    def broken_cursor(*args, **kwargs):
+        raise DBError()
+
+    monkeypatch.setattr("api.views.connection.cursor", broken_cursor)
+    assert client.get("/health/ready").status_code == 503
+
+
+@pytest.mark.mocked
+def test_csv_reader_renders_rows_lazily():
+    """
+    Rows are only rendered as COPY asks for more data
+    """
+    consumed = []
+
+    def rows():
+        for n in range(1000):
+            consumed.append(n)
+            yield (f"Player {n}", None, n)
+
+    reader = CSVReader(rows())
+    first = reader.read(64)
+    assert first.startswith('"Player 0",,0\n')
+    assert len(consumed) < 10
+
+    rest = reader.read()
+    assert len((first + rest).splitlines()) == reader.count == 1000
 
 
 @pytest.mark.mocked
-def test_import_league_404_mocked(client, db):
+def test_get_teams_squads_concurrently():
     """
-    HttpCode 404, {"message": "Not found" } -->
-        if the leagueCode was not found.
+    Squads fetched concurrently are mapped back to the tla of their own team, with
+    their players only
     """
+    teams = [{"id": team_id, "tla": f"T{team_id}"} for team_id in range(1, 25)]
+    with requests_mock.Mocker() as mock:
+        for team in teams:
+            mock.get(
+                f"https://api.football-data.org/v2/teams/{team['id']}",
+                json={
+                    "id": team["id"],
+                    "squad": [
+                        {"name": team["tla"], "role": "PLAYER"},
+                        {"name": "The coach", "role": "COACH"},
+                    ],
+                },
+                status_code=200,
+            )
+        football_data = FootballData("SOMETOKEN", requests_per_minute=len(teams))
+        squads = football_data.get_teams_squads(teams)
+
+    assert len(squads) == len(teams)
+    for tla, squad in squads.items():
+        assert [player.name for player in squad] == [tla]
+
+
+@pytest.mark.mocked
+def test_requests_share_a_pooled_session(settings):
+    """
+    Every FootballData in the process reuses the same kept alive connections and
+    never waits forever for the api
+    """
+    settings.FOOTBALL_DATA_CONNECT_TIMEOUT = 2
+    settings.FOOTBALL_DATA_READ_TIMEOUT = 10
+    first, second = FootballData("SOMETOKEN"), FootballData("OTHERTOKEN")
+    assert first.session is second.session
+
     with requests_mock.Mocker() as mock:
-        # MOCK DEFINITION
         mock.get(
-            "https://api.football-data.org/v2/competitions/SOMEBADCODE",
-            json={
-                "message": (
-                    "Parameter 'competitionId' is expected to be either an "
-                    "integer in a specified range or a competition code."
-                ),
-                "errorCode": 400,
-            },
-            headers={
-                "content-type": "application/json",
-                "X-Auth-Token": "SOMETOKEN",
-            },
-            status_code=400,
+            "https://api.football-data.org/v2/teams/59",
+            json={"id": 59, "squad": []},
+            status_code=200,
         )
+        first.get_team_squad(59)
 
-        # MOCKED CALL
-        response = client.get(
-            "/api/import-league/SOMEBADCODE",
-            {"X-Auth-Token": "SOMETOKEN"},
+    assert mock.last_request.timeout == (2, 10)
+    assert mock.last_request.headers["X-Auth-Token"] == "SOMETOKEN"
+    assert "gzip" in mock.last_request.headers["Accept-Encoding"]
+
+
+@pytest.mark.mocked
+def test_cached_response_is_not_requested_again():
+    """
+    Fresh responses are served from the cache without spending the quota
+    """
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            json={"id": 59, "squad": [{"name": "Tom Trybull"}]},
+            status_code=200,
         )
-    assert response.status_code == 404
-    assert response.json()["message"] == "Not found"
+        first = FootballData("SOMETOKEN").get_team_squad(59)
+        second = FootballData("OTHERTOKEN").get_team_squad(59)
 
+    assert first == second == [{"name": "Tom Trybull"}]
+    assert mock.call_count == 1
+    assert get_response_cache().stats["hits"] == 1
 
-@pytest.mark.not_mocked
-def test_import_league_404(client, db):
+
+@pytest.mark.mocked
+def test_stale_response_is_revalidated(settings):
     """
-    HttpCode 404, {"message": "Not found" } -->
-        if the leagueCode was not found.
+    Stale responses are revalidated with their ETag, a 304 keeps the cached body
     """
-    response = client.get(
-        "/api/import-league/SOMEBADCODE",
-        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
-    )
-    assert response.status_code == 404
-    assert response.json()["message"] == "Not found"
+    settings.FOOTBALL_DATA_CACHE_TTLS = {"squad": 0}
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            [
+                {
+                    "status_code": 200,
+                    "json": {"id": 59, "squad": [{"name": "Tom Trybull"}]},
+                    "headers": {"ETag": '"v1"'},
+                },
+                {"status_code": 304},
+            ],
+        )
+        FootballData("SOMETOKEN").get_team_squad(59)
+        squad = FootballData("SOMETOKEN").get_team_squad(59)
+
+    assert squad == [{"name": "Tom Trybull"}]
+    assert mock.last_request.headers["If-None-Match"] == '"v1"'
+    assert get_response_cache().stats["revalidations"] == 1
 
 
 @pytest.mark.mocked
-def test_import_league_504_db_error(client, db, monkeypatch):
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path, max_entries=2, ttls={"squad": 60})
+    cache.set("https://api.football-data.org/v2/teams/1", {"id": 1}, {})
+    cache.set("https://api.football-data.org/v2/teams/2", {"id": 2}, {})
+    # Team 1 is used after team 2, so team 2 is the one evicted
+    past = time.time() - 10
+    os.utime(cache._path("https://api.football-data.org/v2/teams/2"), (past, past))
+    cache.set("https://api.football-data.org/v2/teams/3", {"id": 3}, {})
+
+    assert cache.get("https://api.football-data.org/v2/teams/1").body == {"id": 1}
+    assert cache.get("https://api.football-data.org/v2/teams/2") is None
+    assert cache.get("https://api.football-data.org/v2/teams/3").fresh
+
+
+@pytest.mark.mocked
+def test_response_cache_evicts_past_the_high_water_mark(tmp_path):
     """
-    HttpCode 504, {"message": "Server Error" } -->
-        If there is any connectivity issue either with
-        the football API or the DB server.
+    Files are only evicted, down to max_entries, once they are a tenth more
     """
+    cache = ResponseCache(tmp_path, max_entries=10, ttls={"squad": 60})
+    for team_id in range(11):
+        cache.set(f"https://api.football-data.org/v2/teams/{team_id}", {}, {})
+    assert len(list(tmp_path.glob("*.json"))) == 11
 
-    def raise_db_error(*args, **kwargs):
-        raise DBError("A mock exception")
+    cache.set("https://api.football-data.org/v2/teams/11", {}, {})
+    assert len(list(tmp_path.glob("*.json"))) == 10
+    # Overwriting a file does not count it again
+    cache.set("https://api.football-data.org/v2/teams/11", {}, {})
+    assert cache._entries == 10
+    assert ResponseCache(tmp_path, max_entries=10, ttls={})._entries == 10
 
-    monkeypatch.setattr(LeagueImportView, "the_league_exists", raise_db_error)
 
-    response = client.get(
-        "/api/import-league/ELC",
-        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.mark.mocked
+def test_token_bucket_paces_requests():
+    """
+    Once the bucket is empty requests wait for the next token instead of failing
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.slept == []
+
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(6.0)]
+
+
+@pytest.mark.mocked
+def test_token_bucket_follows_the_server_counter():
+    """
+    The rate limit headers override whatever the bucket thought was available
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+    bucket.update_from_headers(
+        {"X-Requests-Available-Minute": "0", "X-RequestCounter-Reset": "7"}
     )
-    assert response.status_code == 504
-    assert response.json()["message"] == "Server Error"
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(7.0)]
+
+    # The counter was reset so the whole minute quota is available again
+    for _ in range(9):
+        bucket.acquire()
+    assert len(clock.slept) == 1
 
 
 @pytest.mark.mocked
-def test_import_league_504_api_error(client, db, monkeypatch):
+def test_token_bucket_leaves_its_reserve_to_others():
     """
-    HttpCode 504, {"message": "Server Error" } -->
-        If there is any connectivity issue either with
-        the football API or the DB server.
+    A bucket with a reserve waits for the reset once the server counts no more
+    than the reserve left, whatever it spent itself
     """
+    clock = FakeClock()
+    bucket = TokenBucket(5, clock=clock, sleep=clock.sleep, reserve=5)
+    bucket.update_from_headers(
+        {"X-Requests-Available-Minute": "7", "X-RequestCounter-Reset": "30"}
+    )
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.slept == []
 
-    def raise_api_error(*args, **kwargs):
-        raise ConnectionError("A mock exception")
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(30.0)]
 
-    monkeypatch.setattr(FootballData, "get_competition", raise_api_error)
 
-    response = client.get(
-        "/api/import-league/ELC",
-        {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")},
+@pytest.mark.mocked
+def test_refresh_leaves_the_users_share_of_a_shared_token(db, settings):
+    """
+    The refreshes keep the rest of the quota of their token for the users
+    """
+    settings.FOOTBALL_DATA_REQUESTS_PER_MINUTE = 10
+    settings.REFRESH_REQUESTS_PER_MINUTE = 4
+    assert refresh_next_league("REFRESHTOKEN") is None
+    assert rate_limit.get_rate_limiter("REFRESHTOKEN", 4).reserve == 6
+
+
+@pytest.mark.mocked
+def test_rate_limited_request_waits_for_the_reset():
+    """
+    A 429 is retried after the seconds the server asked for, not a whole minute
+    """
+    clock = FakeClock()
+    rate_limit._rate_limiters["SOMETOKEN"] = TokenBucket(
+        10, clock=clock, sleep=clock.sleep
     )
-    assert response.status_code == 504
-    assert response.json()["message"] == "Server Error"
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            [
+                {
+                    "status_code": 429,
+                    "json": {"message": "Too many requests"},
+                    "headers": {
+                        "X-Requests-Available-Minute": "0",
+                        "X-RequestCounter-Reset": "3",
+                    },
+                },
+                {"status_code": 200, "json": {"id": 59, "squad": []}},
+            ],
+        )
+        squad = FootballData("SOMETOKEN").get_team_squad(59)
+
+    assert squad == []
+    assert clock.slept == [pytest.approx(3.0)]
 
 
 @pytest.mark.mocked
-def test_count_players_200_mocked(client, db):
+def test_squads_are_fetched_over_the_pool_of_keys(settings):
     """
-    HttpCode 200, {"total" : N } -->
-        Counting players of an existsing league
+    The squads fan out over every key, and a key the server says is invalid leaves
+    the rotation
     """
-    import_mock_league(client)
-    response = client.get("/api/total-players/ELC", {"X-Auth-Token": "NOTOKEN"})
-    assert response.status_code == 200
-    assert response.json()["total"] == 2
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    with requests_mock.Mocker() as mock:
+        for team_id in range(1, 7):
+            mock.get(
+                f"https://api.football-data.org/v2/teams/{team_id}",
+                json={"id": team_id, "squad": []},
+            )
+        squads = FootballData(["A", "B", "C"], requests_per_minute=2).get_squads(
+            list(range(1, 7))
+        )
+        keys = sorted(
+            request.headers["X-Auth-Token"] for request in mock.request_history
+        )
+
+    assert len(squads) == 6
+    assert keys == ["A", "A", "B", "B", "C", "C"]
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            request_headers={"X-Auth-Token": "REVOKED"},
+            status_code=403,
+            json={"message": "Your API token is invalid.", "errorCode": 403},
+        )
+        mock.get(
+            "https://api.football-data.org/v2/teams/59",
+            request_headers={"X-Auth-Token": "VALID"},
+            json={"id": 59, "squad": []},
+        )
+        football_data = FootballData(["REVOKED", "VALID"])
+        squads = [football_data.get_team_squad(59) for _ in range(3)]
+        keys = [request.headers["X-Auth-Token"] for request in mock.request_history]
+
+    assert squads == [[], [], []]
+    assert keys.count("REVOKED") == 1
 
 
 @pytest.mark.mocked
-def test_count_players_404_mocked(client, db):
+def test_squad_fan_out_fits_the_connection_pool(settings):
     """
-    HttpCode 404, {"message": "Not Found"} -->
-        Counting players of an unexisting league
+    The squads fetched at once are bounded by the tokens and by the connections
     """
-    import_mock_league(client)
-    response = client.get("/api/total-players/BADLEAGUE", {"X-Auth-Token": "NOTOKEN"})
-    assert response.status_code == 404
-    assert response.json()["message"] == "Not found"
+    settings.FOOTBALL_DATA_POOL_SIZE = 100
+    football_data = FootballData(["A", "B", "C"], requests_per_minute=2)
+    assert football_data._fan_out(10) == 6
+    assert football_data._fan_out(3) == 3
+
+    settings.FOOTBALL_DATA_POOL_SIZE = 4
+    assert football_data._fan_out(10) == 4
+
+
+@pytest.mark.mocked
+def test_resource_out_of_the_plan_keeps_the_key(settings):
+    """
+    A 403 for a resource the plan of the key does not cover fails the request, the
+    key is not taken out of rotation
+    """
+    settings.FOOTBALL_DATA_CACHE_DIR = ""
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            "https://api.football-data.org/v2/competitions/CL/teams",
+            status_code=403,
+            json={
+                "message": "The resource you are looking for is restricted. Please "
+                "pass a valid API token and check your subscription for permission.",
+                "errorCode": 403,
+            },
+        )
+        football_data = FootballData(["BASIC", "OTHER"])
+        with pytest.raises(CompetitionsTeamsError):
+            football_data.get_competitions_teams("CL")
+
+    assert mock.call_count == 1
+    assert all(bucket.enabled for bucket in football_data.tokens.buckets.values())
+
+
+def mock_league_data():
+    """
+    The competition, teams and squads extracted for the mocked league
+    """
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        return LeagueImporter(FootballData("SOMETOKEN")).extract_data("ELC")
 
 
 def import_mock_league(client):
+    # MOCK definition
+    with requests_mock.Mocker() as mock:
+        mock_league(mock)
+        response = client.get(
+            "/api/import-league/ELC", {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")}
+        )
+        run_next_jobs()
+        return response
+
+
+def mock_league(mock):
     # MOCK Prep
     mock_competition = {
         "id": 2016,
@@ -293,27 +1823,50 @@ def import_mock_league(client):
         "X-Auth-Token": "SOMETOKEN",
     }
 
-    # MOCK definition
-    with requests_mock.Mocker() as mock:
-        mock.get(
-            "https://api.football-data.org/v2/competitions/ELC",
-            json=mock_competition,
-            headers=headers,
-            status_code=200,
-        )
-        mock.get(
-            "https://api.football-data.org/v2/competitions/2016/teams",
-            json=mock_competition_teams,
-            headers=headers,
-            status_code=200,
-        )
-        mock.get(
-            "https://api.football-data.org/v2/teams/59",
-            json=mock_teams,
-            headers=headers,
-            status_code=200,
-        )
-        response = client.get(
-            "/api/import-league/ELC", {"X-Auth-Token": os.getenv("API_KEY", "NOTOKEN")}
-        )
-        return response
+    mock.get(
+        "https://api.football-data.org/v2/competitions/ELC",
+        json=mock_competition,
+        headers=headers,
+        status_code=200,
+    )
+    mock.get(
+        "https://api.football-data.org/v2/competitions/2016/teams",
+        json=mock_competition_teams,
+        headers=headers,
+        status_code=200,
+    )
+    mock.get(
+        "https://api.football-data.org/v2/teams/59",
+        json=mock_teams,
+        headers=headers,
+        status_code=200,
+    )
+
+
+def mock_cup(mock):
+    """
+    Mocks a second league whose only team also plays the mocked league
+    """
+    mock.get(
+        "https://api.football-data.org/v2/competitions/FLC",
+        json={
+            "id": 2139,
+            "name": "Football League Cup",
+            "code": "FLC",
+            "area": {"id": 2072, "name": "England"},
+        },
+    )
+    mock.get(
+        "https://api.football-data.org/v2/competitions/2139/teams",
+        json={
+            "teams": [
+                {
+                    "id": 59,
+                    "name": "Blackburn Rovers FC",
+                    "shortName": "Blackburn",
+                    "tla": "BBR",
+                    "area": {"id": 2072, "name": "England"},
+                },
+            ]
+        },
+    )
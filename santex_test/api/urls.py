@@ -1,8 +1,33 @@
+from django.conf import settings
 from django.urls import path
+from rest_framework.routers import DefaultRouter
 
-from api.views import LeagueImportView, PlayerCounterView
+from api.views import (
+    CompetitionViewSet,
+    ImportJobView,
+    LeagueExportView,
+    LeagueImportView,
+    LeaguesImportView,
+    LeagueStatsView,
+    PlayerViewSet,
+    TeamViewSet,
+    async_total_players,
+    total_players,
+)
+
+router = DefaultRouter(trailing_slash=False)
+router.register("competitions", CompetitionViewSet)
+router.register("teams", TeamViewSet)
+router.register("players", PlayerViewSet)
 
 urlpatterns = [
     path("import-league/<str:league_code>", LeagueImportView.as_view()),
-    path("total-players/<str:league_code>", PlayerCounterView.as_view()),
-]
+    path("import-leagues", LeaguesImportView.as_view()),
+    path("import-jobs/<int:job_id>", ImportJobView.as_view()),
+    path(
+        "total-players/<str:league_code>",
+        async_total_players if settings.ASYNC_VIEWS else total_players,
+    ),
+    path("stats/<str:league_code>", LeagueStatsView.as_view()),
+    path("export/<str:league_code>", LeagueExportView.as_view()),
+] + router.urls
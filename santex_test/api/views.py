@@ -1,48 +1,77 @@
-from typing import List, Tuple
+from functools import wraps
 
 from rest_framework.views import APIView
+from rest_framework.viewsets import ReadOnlyModelViewSet
 from rest_framework.response import Response
 from rest_framework import status
-from django.db import transaction
-from django.db.models import Count
+from django.conf import settings
+from django.db import Error as DBError, connection
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.http import require_safe
 
 
-from api.football_data import (
-    FootballData,
-    CompetitionNotFound,
-    CompetitionsTeamsError,
-    TeamError,
+from api.async_db import database_sync_to_async
+from api.export import EXPORTS, export_csv
+from api.filters import CompetitionFilter, PlayerFilter, TeamFilter
+from api.football_data import FootballData
+from api.jobs import enqueue_import, enqueue_imports
+from api.metrics import render_metrics
+from api.models import Competition, ImportJob, Player, Team
+from api.pagination import IdCursorPagination
+from api.player_counts import get_total_players
+from api.reads import read_counter
+from api.stats import get_league_summary
+from api.serializers import (
+    CompetitionSerializer,
+    ImportJobSerializer,
+    LeagueCodesSerializer,
+    LeagueSummarySerializer,
+    PlayerSerializer,
+    TeamSerializer,
 )
-from api.models import Competition, Team, Player
 
 
 class LeagueImportView(APIView):
+    """
+    Queues the import of a league. The import itself is run by the import worker,
+    its progress is reported by ImportJobView. With mode=sync a league already
+    imported is brought up to date instead of answering 409. While the league has
+    an import queued or running the caller gets that job instead of a new one.
+    """
+
     def get(self, request, league_code, format=None):
+        api_key = request.query_params.get(FootballData.AUTH_HEADER)
+        if not api_key:
+            return Response(
+                {"message": f"Missing {FootballData.AUTH_HEADER}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        sync = request.query_params.get("mode") == ImportJob.SYNC
         try:
-            if self.the_league_exists(league_code):
+            if not sync and self.the_league_exists(league_code):
                 response = Response(
                     {"message": "League already imported"},
                     status=status.HTTP_409_CONFLICT,
                 )
                 return response
 
-            raw_competition, raw_teams, raw_players = self.extract_data(
-                request, league_code
-            )
-
-            with transaction.atomic():
-                self.persist_data(raw_competition, raw_teams, raw_players)
-
+            mode = ImportJob.SYNC if sync else ImportJob.IMPORT
+            job, created = enqueue_import(league_code, api_key, mode=mode)
+            message = "Import queued" if created else "Import already in progress"
             response = Response(
-                {"message": "Successfully imported"},
-                status=status.HTTP_201_CREATED,
-            )
-        except (CompetitionNotFound, CompetitionsTeamsError, TeamError):
-            response = Response(
-                {"message": "Not found"},
-                status=status.HTTP_404_NOT_FOUND,
+                {"message": message, "job_id": job.id},
+                status=status.HTTP_202_ACCEPTED,
             )
-        except Exception as ex:
+        except DBError:
             response = Response(
                 {"message": "Server Error"}, status=status.HTTP_504_GATEWAY_TIMEOUT
             )
@@ -52,82 +81,251 @@ class LeagueImportView(APIView):
     def the_league_exists(self, code) -> bool:
         return Competition.objects.filter(code=code).exists()
 
-    def extract_data(self, request, league_code) -> Tuple[List, List, List]:
-        football_data: FootballData = FootballData(
-            request.query_params[FootballData.AUTH_HEADER]
-        )
 
-        raw_competition: dict = football_data.get_competition(league_code)
-        raw_teams: List[dict] = football_data.get_competitions_teams(
-            raw_competition["id"]
-        )
-        raw_players = {
-            team["tla"]: football_data.get_team_squad(team["id"]) for team in raw_teams
-        }
-        return raw_competition, raw_teams, raw_players
-
-    def persist_data(self, raw_competition, raw_teams, raw_players) -> None:
-        competition: Competition = self.build_competition(raw_competition)
-        competition.save()
-        teams = self.build_teams(raw_teams, competition)
-        Team.objects.bulk_create(teams)
-        teams = Team.objects.filter(competition=competition)
-        players = []
-        for team in teams:
-            if team.tla in raw_players:
-                players.extend(self.build_players(raw_players.get(team.tla), team))
-        Player.objects.bulk_create(players)
-
-    def build_competition(self, raw_competition):
-        competition = Competition(
-            name=raw_competition.get("name"),
-            code=raw_competition.get("code"),
-            area_name=raw_competition.get("area").get("name"),
-        )
-        return competition
-
-    def build_teams(self, raw_teams: List[dict], competition: Competition):
-        teams = [
-            Team(
-                name=rt.get("name"),
-                tla=rt.get("tla"),
-                short_name=rt.get("shortName"),
-                area_name=rt.get("area").get("name"),
-                email=rt.get("email"),
-                competition=competition,
+class LeaguesImportView(APIView):
+    """
+    Queues the import of many leagues at once. The worker imports them together,
+    sharing the rate limit of the token and fetching the squads of teams playing
+    in more than one of the leagues once.
+    """
+
+    def post(self, request, format=None):
+        api_key = request.query_params.get(FootballData.AUTH_HEADER)
+        if not api_key:
+            return Response(
+                {"message": f"Missing {FootballData.AUTH_HEADER}"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            for rt in raw_teams
-        ]
-        return teams
-
-    def build_players(self, raw_players: List[dict], team: Team):
-        players = [
-            Player(
-                name=p.get("name"),
-                position=p.get("position"),
-                date_of_birth=p.get("dateOfBirth"),
-                country_of_birth=p.get("countryOfBirth"),
-                nationality=p.get("nationality"),
-                team=team,
+
+        serializer = LeagueCodesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Keeps the order of the codes, without repeating them
+        codes = list(dict.fromkeys(serializer.validated_data["codes"]))
+
+        try:
+            imported = set(
+                Competition.objects.filter(code__in=codes).values_list(
+                    "code", flat=True
+                )
+            )
+            pending = [code for code in codes if code not in imported]
+            if not pending:
+                return Response(
+                    {"message": "Leagues already imported"},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            batch, jobs = enqueue_imports(pending, api_key)
+            response = Response(
+                {
+                    "message": "Import queued",
+                    "batch": batch,
+                    "jobs": {job.league_code: job.id for job in jobs},
+                    "already_imported": sorted(imported),
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
+        except DBError:
+            response = Response(
+                {"message": "Server Error"}, status=status.HTTP_504_GATEWAY_TIMEOUT
             )
-            for p in raw_players
-            if p.get("role") == "PLAYER"
-        ]
-        return players
 
+        return response
 
-class PlayerCounterView(APIView):
-    def get(self, request, league_code, format=None):
+
+class ImportJobView(APIView):
+    def get(self, request, job_id, format=None):
         try:
-            competition = Competition.objects.get(code=league_code)
-            annotation = competition.team_set.all().aggregate(Count("player"))
+            job = ImportJob.objects.get(pk=job_id)
             response = Response(
-                {"total": annotation.get("player__count")},
+                ImportJobSerializer(job).data,
                 status=status.HTTP_200_OK,
             )
-        except Competition.DoesNotExist:
+        except ImportJob.DoesNotExist:
             response = Response(
                 {"message": "Not found"},
                 status=status.HTTP_404_NOT_FOUND,
             )
         return response
+
+
+class LeagueStatsView(APIView):
+    """
+    Players of a league by position and nationality, their average age and the
+    squad size of every team, read from the summary the importer keeps
+    """
+
+    def get(self, request, league_code, format=None):
+        summary = get_league_summary(league_code)
+        if summary is None:
+            return Response({"message": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+        if read_counter.count(league_code):
+            read_counter.flush()
+        return Response(
+            LeagueSummarySerializer(summary).data, status=status.HTTP_200_OK
+        )
+
+
+class LeagueExportView(APIView):
+    """
+    Streams the players, or with table=teams the teams, of a league as CSV. Rows
+    are read and sent a chunk at a time, memory stays flat however big the league
+    is. Under asgi.py the chunks are read in a thread of their own, see
+    api.async_db.StreamingASGIHandler.
+    """
+
+    def get(self, request, league_code, format=None):
+        table = request.query_params.get("table", "players")
+        if table not in EXPORTS:
+            return Response(
+                {"message": f"table must be one of {', '.join(EXPORTS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not Competition.objects.filter(code=league_code).exists():
+            return Response({"message": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(
+            export_csv(league_code, table), content_type="text/csv; charset=utf-8"
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{league_code}-{table}.csv"'
+        return response
+
+
+class CompetitionViewSet(ReadOnlyModelViewSet):
+    """
+    Imported competitions, a few dozens at most so they are paginated by page
+    number
+    """
+
+    queryset = Competition.objects.order_by("id")
+    serializer_class = CompetitionSerializer
+    filterset_class = CompetitionFilter
+
+
+class TeamViewSet(ReadOnlyModelViewSet):
+    """
+    Teams with the codes of their competitions, fetched for the whole page in a
+    second query
+    """
+
+    queryset = Team.objects.prefetch_related("competitions")
+    serializer_class = TeamSerializer
+    filterset_class = TeamFilter
+    pagination_class = IdCursorPagination
+
+
+class PlayerViewSet(ReadOnlyModelViewSet):
+    """
+    Players with their team, joined in the same query
+    """
+
+    queryset = Player.objects.select_related("team")
+    serializer_class = PlayerSerializer
+    filterset_class = PlayerFilter
+    pagination_class = IdCursorPagination
+
+
+class MetricsView(APIView):
+    """
+    Import metrics in the Prometheus text exposition format
+    """
+
+    def get(self, request, format=None):
+        return HttpResponse(
+            render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
+def async_get(view):
+    """
+    Answers 405 to anything but GET and HEAD, the decorators of Django 3.1 can not
+    wrap coroutines
+    """
+
+    @wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        return await view(request, *args, **kwargs)
+
+    return inner
+
+
+def total_players_response(request, league_code, total):
+    if total is None:
+        return JsonResponse({"message": "Not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    etag = quote_etag(f"{league_code}-{total}")
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({"total": total}, status=status.HTTP_200_OK)
+    response["ETag"] = etag
+    patch_cache_control(response, max_age=settings.TOTAL_PLAYERS_MAX_AGE)
+    return response
+
+
+@require_safe
+def total_players(request, league_code):
+    """
+    Answers from the denormalized player count of the league, clients can
+    revalidate the response with its ETag
+    """
+    total = get_total_players(league_code)
+    if total is not None and read_counter.count(league_code):
+        read_counter.flush()
+    return total_players_response(request, league_code, total)
+
+
+@async_get
+async def async_total_players(request, league_code):
+    """
+    total_players served from asgi.py, thousands of reads wait on the cache and
+    the database without holding a worker each
+    """
+    total = await database_sync_to_async(get_total_players)(league_code)
+    if total is not None and read_counter.count(league_code):
+        await database_sync_to_async(read_counter.flush)()
+    return total_players_response(request, league_code, total)
+
+
+@require_safe
+def liveness(request):
+    """
+    Answers as long as the process serves requests
+    """
+    return JsonResponse({"status": "ok"}, status=status.HTTP_200_OK)
+
+
+@async_get
+async def async_liveness(request):
+    return JsonResponse({"status": "ok"}, status=status.HTTP_200_OK)
+
+
+def ping_database() -> None:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+
+@require_safe
+def readiness(request):
+    """
+    Answers 503 while the database can not be reached
+    """
+    try:
+        ping_database()
+        response = JsonResponse({"status": "ok"}, status=status.HTTP_200_OK)
+    except DBError:
+        response = JsonResponse(
+            {"status": "database unavailable"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return response
+
+
+@async_get
+async def async_readiness(request):
+    return await database_sync_to_async(readiness)(request)
@@ -0,0 +1,23 @@
+"""
+Gunicorn settings of the production server, see entry_point.sh.
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+import multiprocessing
+import os
+
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# gthread serves WSGI with threads per worker, uvicorn.workers.UvicornWorker serves
+# santex_test.asgi:application instead
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("GUNICORN_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+# Ignored by the uvicorn workers, every thread holds its own database connection
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycles the workers now and then, so a leak can not grow forever
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+# An empty GUNICORN_ACCESSLOG turns the access log off, it costs throughput
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+errorlog = "-"
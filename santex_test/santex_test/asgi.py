@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "santex_test.settings")
+# The async views query the database from a pool of threads, see api.async_db
+os.environ.setdefault("DATABASE_THREAD_POOL", "1")
+# Routes the reads that have one to their async view, see settings.ASYNC_VIEWS
+os.environ.setdefault("ASYNC_VIEWS", "1")
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Streams the export from a thread, see api.async_db.StreamingASGIHandler
+from api.async_db import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
@@ -24,7 +24,7 @@ BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 SECRET_KEY = os.getenv("SECRET_KEY", "the_most_secret_key_ever")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = bool(int(os.getenv("DEBUG", "1")))  # DEBUG must be either 0 or any integer
+DEBUG = bool(int(os.getenv("DEBUG", "0")))  # DEBUG must be either 0 or any integer
 
 ALLOWED_HOSTS = ["*"]
 
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "rest_framework",
+    "django_filters",
     "api",
 ]
 
@@ -84,6 +85,9 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", "mypassword"),
         "HOST": "database",
         "PORT": "5432",
+        # Seconds a connection is kept open for the next requests, 0 closes it after
+        # every request as Django does by default
+        "CONN_MAX_AGE": int(os.getenv("CONN_MAX_AGE", "60")),
     }
 }
 
@@ -104,6 +108,81 @@ DATABASES = {
 }
 """
 
+# League import
+
+# Rows per INSERT statement when bulk creating teams and players
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# Leagues with at least this many players are written with PostgreSQL COPY instead
+# of INSERTs, 0 disables COPY
+IMPORT_COPY_THRESHOLD = int(os.getenv("IMPORT_COPY_THRESHOLD", "2000"))
+# Seconds after which a running import is taken for abandoned by a dead worker, and
+# a new request for its league queues another one
+IMPORT_JOB_STALE_AFTER = int(os.getenv("IMPORT_JOB_STALE_AFTER", "3600"))
+# Seconds the payloads fetched by a failed import are resumed from by the next
+# import of the league, see api.checkpoints
+IMPORT_CHECKPOINT_MAX_AGE = int(os.getenv("IMPORT_CHECKPOINT_MAX_AGE", "86400"))
+# The same for the syncs, which must not write payloads fetched long ago
+SYNC_CHECKPOINT_MAX_AGE = int(os.getenv("SYNC_CHECKPOINT_MAX_AGE", "300"))
+
+# Rows read from the database at a time by the exports, see api.export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+
+# Scheduled refresh, see api.refresh
+
+# Seconds between refreshes of a league, and before retrying a failed one
+REFRESH_INTERVAL = int(os.getenv("REFRESH_INTERVAL", "21600"))
+REFRESH_RETRY_AFTER = int(os.getenv("REFRESH_RETRY_AFTER", "900"))
+# Seconds the reads of the leagues are counted in memory before being stored
+READ_COUNTS_FLUSH_INTERVAL = float(os.getenv("READ_COUNTS_FLUSH_INTERVAL", "10"))
+
+# Async
+
+# Served from asgi.py the async views query the database from a pool of threads,
+# see api.async_db. ASGI_THREADS sizes the pool.
+DATABASE_THREAD_POOL = bool(int(os.getenv("DATABASE_THREAD_POOL", "0")))
+# The player count and the health checks are routed to their async views, set by
+# asgi.py. Under WSGI Django would run every call of an async view on an event
+# loop of its own, the sync views are faster there.
+ASYNC_VIEWS = bool(int(os.getenv("ASYNC_VIEWS", "0")))
+# The import worker fetches from football-data.org with AsyncFootballData
+FOOTBALL_DATA_ASYNC = bool(int(os.getenv("FOOTBALL_DATA_ASYNC", "0")))
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", "santex_test"),
+    }
+}
+
+# Seconds a player count is kept in the cache. The import worker runs in another
+# process so, with a local memory cache, this bounds how stale a count can be.
+TOTAL_PLAYERS_CACHE_TIMEOUT = int(os.getenv("TOTAL_PLAYERS_CACHE_TIMEOUT", "60"))
+# Seconds clients may reuse a player count before revalidating it
+TOTAL_PLAYERS_MAX_AGE = int(os.getenv("TOTAL_PLAYERS_MAX_AGE", "60"))
+
+# Logging
+# https://docs.djangoproject.com/en/3.1/topics/logging/
+
+# The api logs, import jobs among them, are written as JSON lines
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {"json": {"()": "api.json_log.JSONFormatter"}},
+    "handlers": {"json": {"class": "logging.StreamHandler", "formatter": "json"}},
+    "loggers": {
+        "api": {
+            "handlers": ["json"],
+            "level": os.getenv("API_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        }
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -145,4 +224,65 @@ STATIC_URL = "/static/"
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 10,
+    "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+}
+
+# football-data.org
+# https://www.football-data.org/documentation/api
+
+# Root of the api, the benchmarks point it to a local stand-in
+FOOTBALL_DATA_URL = os.getenv("FOOTBALL_DATA_URL", "https://api.football-data.org/v2")
+
+# Requests per minute allowed for the tokens in use, free tier tokens get 10
+FOOTBALL_DATA_REQUESTS_PER_MINUTE = int(
+    os.getenv("FOOTBALL_DATA_REQUESTS_PER_MINUTE", "10")
+)
+# Pool of tokens the imports spread their requests over, along with the token of
+# the caller, comma separated. Each is allowed FOOTBALL_DATA_REQUESTS_PER_MINUTE.
+FOOTBALL_DATA_API_KEYS = [
+    key for key in os.getenv("FOOTBALL_DATA_API_KEYS", "").split(",") if key
+]
+# Seconds a token refused by football-data.org stays out of the pool
+FOOTBALL_DATA_FORBIDDEN_KEY_COOLDOWN = int(
+    os.getenv("FOOTBALL_DATA_FORBIDDEN_KEY_COOLDOWN", "3600")
+)
+
+# Token of the scheduled refreshes, and the requests per minute they make. A token
+# of its own keeps them off the quota of the users. With a shared one they only
+# spend it while the server counts more than the rest of the quota left.
+FOOTBALL_DATA_REFRESH_API_KEY = os.getenv("FOOTBALL_DATA_REFRESH_API_KEY", "")
+REFRESH_REQUESTS_PER_MINUTE = int(
+    os.getenv(
+        "REFRESH_REQUESTS_PER_MINUTE",
+        str(max(1, FOOTBALL_DATA_REQUESTS_PER_MINUTE // 2)),
+    )
+)
+
+# Kept alive connections to the api, there is no use for more connections than
+# concurrent squad fetches. Those are as many as the requests per minute of the
+# caller's token and the pool, and no more than this.
+FOOTBALL_DATA_POOL_SIZE = int(
+    os.getenv(
+        "FOOTBALL_DATA_POOL_SIZE",
+        str(FOOTBALL_DATA_REQUESTS_PER_MINUTE * (len(FOOTBALL_DATA_API_KEYS) + 1)),
+    )
+)
+
+# Seconds to wait for the connection to be established and for the response
+FOOTBALL_DATA_CONNECT_TIMEOUT = float(os.getenv("FOOTBALL_DATA_CONNECT_TIMEOUT", "5"))
+FOOTBALL_DATA_READ_TIMEOUT = float(os.getenv("FOOTBALL_DATA_READ_TIMEOUT", "30"))
+
+# Responses are cached on disk so re-imports and leagues sharing teams do not spend
+# the quota again. An empty FOOTBALL_DATA_CACHE_DIR disables the cache.
+FOOTBALL_DATA_CACHE_DIR = os.getenv(
+    "FOOTBALL_DATA_CACHE_DIR", str(BASE_DIR / ".football_data_cache")
+)
+FOOTBALL_DATA_CACHE_MAX_ENTRIES = int(
+    os.getenv("FOOTBALL_DATA_CACHE_MAX_ENTRIES", "5000")
+)
+# Seconds each endpoint response is fresh for, stale ones are revalidated
+FOOTBALL_DATA_CACHE_TTLS = {
+    "competition": 24 * 60 * 60,
+    "teams": 24 * 60 * 60,
+    "squad": 6 * 60 * 60,
 }
@@ -13,13 +13,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from api.views import (
+    MetricsView,
+    async_liveness,
+    async_readiness,
+    liveness,
+    readiness,
+)
+
 # from api import urls as api_urls
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api-auth/", include("rest_framework.urls")),
     path("api/", include("api.urls")),
+    path("metrics", MetricsView.as_view()),
+    path("health/live", async_liveness if settings.ASYNC_VIEWS else liveness),
+    path("health/ready", async_readiness if settings.ASYNC_VIEWS else readiness),
 ]